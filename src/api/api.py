@@ -19,11 +19,20 @@ import kore
 import time
 import json
 import jinja2
+import hashlib
 import secrets
+import concurrent.futures
 
 from datetime import datetime
 
 from queries import *
+from leader import Leader
+from database import Database
+from fileio import FileIO, FILEIO_SYSCALLS, pwrite
+from tokens import TokenRefresher
+from maintenance import Maintenance
+from flockfilter import FlockFilter
+from cathedrals import CathedralCache
 from ratelimit import RateLimit
 
 ACCOUNT_URLS = [
@@ -41,41 +50,99 @@ ACCOUNT_URLS_EXPIRED = [
     "/account/logout"
 ]
 
+AMBRY_SIZES = [
+    7542970,
+    3756730
+]
+
+AMBRY_CHUNK = 65536
+
+AMBRY_HISTORY = 4
+
+KEK_ATTEMPTS = 4
+
+DEVICE_BATCH_MAX = 255
+
+TEMPLATES_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "templates"
+)
+
+TEMPLATES = [
+    "login.html",
+    "account.html",
+    "flock.html"
+]
+
 UNAUTHED_URLS = [
     "/v1/init",
     "/v1/register",
     "/v1/device/create"
 ]
 
+class Route:
+    def __init__(self, name, web=False, authed=True, expired=False):
+        self.name = name
+        self.web = web
+        self.authed = authed
+        self.expired = expired
+
+ROUTE_API = Route("api")
+ROUTE_WEB = Route("web", web=True)
+ROUTE_WEB_EXPIRED = Route("web-expired", web=True, expired=True)
+ROUTE_UNAUTHED = Route("unauthed", authed=False)
+ROUTE_REGISTER = Route("register", authed=False)
+ROUTE_DEVICE_CREATE = Route("device-create", authed=False)
+
+class RouteClassifier:
+    def __init__(self):
+        self.exact = {}
+
+        for url in UNAUTHED_URLS:
+            self.exact[url] = ROUTE_UNAUTHED
+
+        for url in ACCOUNT_URLS:
+            self.exact[url] = ROUTE_WEB
+
+        for url in ACCOUNT_URLS_EXPIRED:
+            self.exact[url] = ROUTE_WEB_EXPIRED
+
+        self.exact["/v1/register"] = ROUTE_REGISTER
+        self.exact["/account/login"] = ROUTE_UNAUTHED
+        self.device_create = re.compile("^/v1/device/[a-f0-9]{16}/create$")
+
+    def classify(self, path):
+        route = self.exact.get(path)
+        if route is not None:
+            return route
+
+        if path.startswith(("/account/flock/", "/account/xflock/")):
+            return ROUTE_WEB
+
+        if self.device_create.match(path):
+            return ROUTE_DEVICE_CREATE
+
+        return ROUTE_API
+
 @kore.prerequest
 async def ratelimit(req):
     req.account = None
     req.account_max_flocks = None
+    req.route = kore.app().routes.classify(req.path)
 
-    match = re.findall("^/account/[x]?flock/.*$", req.path)
-    if req.path in ACCOUNT_URLS or match:
+    if req.route.web:
         return True
 
-    if not kore.app().ratelimit.check(req.connection.addr, req.path):
+    if not kore.app().ratelimit.check(req.connection.addr, req.route.name):
         req.response(429, None)
         return False
 
 @kore.prerequest
 async def token_fetch(req):
-    if req.path == "/account/login":
-        return
-
-    match = re.findall("^/v1/device/([a-f0-9]{16})/create$", req.path)
-    if req.path in UNAUTHED_URLS or match:
+    if not req.route.authed:
         return
 
-    match = re.findall("^/account/[x]?flock/.*$", req.path)
-    if req.path in ACCOUNT_URLS or match:
-        is_web = True
-    else:
-        is_web = False
-
-    if is_web:
+    if req.route.web:
         web = 't'
         token = req.populate_cookies()
         token = req.cookie("token")
@@ -84,7 +151,7 @@ async def token_fetch(req):
         token = req.request_header("x-token")
 
     if token is None:
-        if is_web:
+        if req.route.web:
             req.response_header("location", "/account/login")
             req.response(302, None)
         else:
@@ -94,7 +161,7 @@ async def token_fetch(req):
     res = await kore.dbquery("db", SQL_ACCOUNT_FROM_TOKEN, params=[token, web])
 
     if len(res) != 1:
-        if is_web:
+        if req.route.web:
             req.response_header("location", "/account/login")
             req.response(302, None)
         else:
@@ -104,10 +171,10 @@ async def token_fetch(req):
     now = time.time()
     req.expires = int(res[0]["account_time_left"])
     if req.expires < now:
-        if is_web is False:
+        if req.route.web is False:
             req.response(403, b'account expired')
             return False
-        elif req.path not in ACCOUNT_URLS_EXPIRED:
+        elif req.route.expired is False:
             req.response_header("location", "/account/")
             req.response(302, None)
             return False
@@ -115,17 +182,15 @@ async def token_fetch(req):
     else:
         req.expires = req.expires - now
 
+    kore.app().tokens.touch(token, int(res[0]["token_expires"]))
+
     req.account = res[0]["account_id"]
     req.account_key = res[0]["account_key"]
     req.account_max_flocks = int(res[0]["account_flocks_max"])
 
 @kore.prerequest
 def token_verify(req):
-    if req.path == "/account/login":
-        return
-
-    match = re.findall("^/v1/device/([a-f0-9]{16})/create$", req.path)
-    if req.path in UNAUTHED_URLS or match:
+    if not req.route.authed:
         return
 
     if not req.account:
@@ -134,8 +199,6 @@ def token_verify(req):
 class Api:
     def __init__(self):
         kore.app(self)
-        self.loader = jinja2.FileSystemLoader("templates")
-        self.templates = jinja2.Environment(loader=self.loader)
 
     def allow(self, seccomp, name):
         try:
@@ -146,28 +209,97 @@ class Api:
     def seccomp(self, seccomp):
         self.allow(seccomp, "renameat")
         self.allow(seccomp, "rename")
+        self.allow(seccomp, "unlink")
+        self.allow(seccomp, "unlinkat")
+        self.allow(seccomp, "flock")
+        self.allow(seccomp, "link")
+        self.allow(seccomp, "linkat")
+        self.allow(seccomp, "mkdir")
+        self.allow(seccomp, "mkdirat")
+        self.allow(seccomp, "rmdir")
+
+        for name in FILEIO_SYSCALLS:
+            self.allow(seccomp, name)
 
     def configure(self, args):
         self.dbhost = os.getenv("DBHOST", default="/var/run/postgresql")
-        kore.dbsetup("db", f"host={self.dbhost} dbname=accounts")
+        self.db = Database(self.dbhost,
+            os.getenv("DBHOST_REPLICA"),
+            int(os.getenv("API_REPLICA_INTERVAL", default="5")),
+            float(os.getenv("API_REPLICA_MAX_LAG", default="2"))
+        )
 
-        kore.config.workers = 1
         kore.config.seccomp_tracing = "yes"
         kore.config.pidfile = "/tmp/api.pid"
         kore.config.tls_dhparam = "/usr/local/share/kore/ffdhe4096.pem"
+        kore.config.workers = int(
+            os.getenv("API_WORKERS", default=f"{os.cpu_count()}")
+        )
 
-        self.ratelimit = RateLimit(self)
+        self.leader = Leader("/tmp/api.leader")
+        self.routes = RouteClassifier()
+        self.device_id = re.compile("^[a-f0-9]{8}$")
+        self.device_cosk = re.compile("^[a-f0-9]{64}$")
+        self.ratelimit = RateLimit(self,
+            int(os.getenv("API_RATELIMIT_SETS", default="65536"))
+        )
         self.domain = os.getenv("API_DOMAIN", default="*")
         self.deployment = os.getenv("API_DEPLOYMENT", default="dev")
         self.cathedral_nat = os.getenv("API_CATHEDRAL_NAT", default="4470")
         self.cathedral = os.getenv("API_CATHEDRAL", default="127.0.0.1:4500")
         self.ambry_path = os.getenv("API_AMBRY_PATH", default="shared/ambries")
+        self.ambry_store_path = os.getenv("API_AMBRY_STORE", default="ambry-store")
+        self.etags = {}
+        self.fileio = FileIO(
+            int(os.getenv("API_FILEIO_THREADS", default="2"))
+        )
 
-        kore.task_create(self.expire_tokens())
+        self.tokens = TokenRefresher(self,
+            int(os.getenv("API_TOKEN_FLUSH_INTERVAL", default="60")),
+            int(os.getenv("API_TOKEN_SLACK", default="86400"))
+        )
 
+        self.cathedrals = CathedralCache(self.db,
+            int(os.getenv("API_CATHEDRAL_POLL", default="10"))
+        )
+
+        self.maintenance = Maintenance(self.leader,
+            int(os.getenv("API_MAINTENANCE_BATCH", default="1000")),
+            int(os.getenv("API_MAINTENANCE_PAUSE", default="100"))
+        )
+
+        self.flock_filter = FlockFilter(
+            int(os.getenv("API_FLOCK_FILTER_SIZE", default="1048576"))
+        )
+
+        self.ambry_orphans = []
+        self.maintenance.job("flock-filter", 3600,
+            self.maintenance_flock_filter, immediate=True)
+        self.maintenance.job("tokens", 30, self.maintenance_tokens,
+            backlog=self.maintenance_tokens_backlog)
+        self.maintenance.job("ambries", 3600, self.maintenance_ambries,
+            backlog=self.maintenance_ambries_backlog)
+
+        retention = os.getenv("API_ACCOUNT_RETENTION")
+        if retention is not None:
+            self.account_retention = int(retention) * 86400
+            self.maintenance.job("accounts", 3600, self.maintenance_accounts,
+                backlog=self.maintenance_accounts_backlog)
+
+        #
+        # The disk offload applies to every route, req.body is None for
+        # any body above AMBRY_CHUNK, handlers that take a small body
+        # check for that before looking at it.
+        #
         kore.config.http_body_max = 7542971
+        kore.config.http_body_disk_offload = AMBRY_CHUNK
+        kore.config.http_body_disk_path = os.getenv(
+            "API_BODY_PATH", default="/tmp"
+        )
         kore.config.deployment = self.deployment
 
+        self.templates_load()
+
         if self.deployment != "dev":
             kore.privsep("keymgr",
                 root="/home/keymgr",
@@ -231,6 +363,12 @@ class Api:
             self.device_approve, methods=["post"])
         d.route("^/v1/device/list/([a-f0-9]{16})$",
             self.device_list, methods=["get"])
+        d.route("^/v1/device/([a-f0-9]{16})/enroll$",
+            self.device_enroll, methods=["post"])
+        d.route("^/v1/device/([a-f0-9]{16})/approve$",
+            self.device_approve_batch, methods=["post"])
+        d.route("^/v1/device/([a-f0-9]{16})/delete$",
+            self.device_delete_batch, methods=["post"])
 
         d.route("/v1/xflock/list", self.xflock_list, methods=["get"])
         d.route("^/v1/xflock/([a-f0-9]{16})/([a-f0-9]{16})/create",
@@ -238,42 +376,126 @@ class Api:
         d.route("^/v1/xflock/([a-f0-9]{16})/([a-f0-9]{16})/delete$",
             self.xflock_delete, methods=["post"])
         d.route("^/v1/xflock/([a-f0-9]{16})/([a-f0-9]{16})/ambry$",
-            self.xflock_ambry_upload, methods=["post"],
+            self.xflock_ambry, methods=["get", "post"],
         )
 
         d.route("/v1/init", self.init, methods=["post"])
         d.route("/v1/register", self.register, methods=["post"])
 
         d.route("^/v1/ambry/([a-f0-9]{16})$",
-            self.ambry_upload, methods=["post"],
+            self.ambry, methods=["get", "post"],
+        )
+        d.route("^/v1/ambry/([a-f0-9]{16})/blocks$",
+            self.ambry_blocks, methods=["get"],
+        )
+        d.route("^/v1/ambry/([a-f0-9]{16})/delta$",
+            self.ambry_delta, methods=["post"],
         )
 
-    async def expire_tokens(self):
-        while True:
-            await kore.suspend(30000)
-            kore.log(kore.LOG_INFO, "expiring tokens")
-            await kore.dbquery("db", SQL_EXPIRE_TOKENS)
+    #
+    # Compile the account templates once, before the workers are forked,
+    # so they start out warm. Outside of dev the templates are never
+    # checked for changes on disk again.
+    #
+    def templates_load(self):
+        self.loader = jinja2.FileSystemLoader(TEMPLATES_PATH)
+        self.templates = jinja2.Environment(
+            loader=self.loader,
+            auto_reload=(self.deployment == "dev")
+        )
 
-    async def cathedral_list(self, req):
-        cathedrals = await kore.dbquery("db", SQL_GET_CATHEDRALS)
+        for name in TEMPLATES:
+            self.templates.get_template(name)
 
-        resp = ""
-        for cathedral in cathedrals:
-            ip = cathedral["cathedral_ip"]
-            port = cathedral["cathedral_port"]
-            descr = cathedral["cathedral_descr"]
+    async def maintenance_tokens(self, batch):
+        res = await kore.dbquery("db",
+            SQL_EXPIRE_TOKENS,
+            params=[f"{batch}"]
+        )
 
-            if descr != "":
-                resp = resp + f"{descr} - {ip}:{port}\n"
-            else:
-                resp = resp + f"{ip}:{port}\n"
+        rows = int(res[0]["rows"])
+        return rows, rows == batch
 
-        req.response(200, resp)
+    async def maintenance_tokens_backlog(self, limit):
+        res = await kore.dbquery("db",
+            SQL_EXPIRE_TOKENS_BACKLOG,
+            params=[f"{limit}"]
+        )
+
+        return int(res[0]["rows"])
+
+    #
+    # (Re)load the flock filter, this also clears out the false
+    # positives left behind by flocks removed through account deletes.
+    #
+    async def maintenance_flock_filter(self, batch):
+        rows = await self.flock_filter.load()
+        return rows, False
 
-    async def flocks_for_account(self, account):
+    async def maintenance_accounts(self, batch):
         res = await kore.dbquery("db",
+            SQL_EXPIRE_ACCOUNTS,
+            params=[f"{batch}", f"{self.account_retention}"]
+        )
+
+        rows = int(res[0]["rows"])
+        return rows, rows == batch
+
+    async def maintenance_accounts_backlog(self, limit):
+        res = await kore.dbquery("db",
+            SQL_EXPIRE_ACCOUNTS_BACKLOG,
+            params=[f"{limit}", f"{self.account_retention}"]
+        )
+
+        return int(res[0]["rows"])
+
+    #
+    # Walks the ambry directory batch names at a time and removes the
+    # ambries, including their history, of flocks and xflocks that are
+    # gone. A new walk starts once the previous one is done.
+    #
+    async def maintenance_ambries(self, batch):
+        if len(self.ambry_orphans) == 0:
+            names = await self.fileio.run(os.listdir, self.ambry_path)
+            self.ambry_orphans = [name[6:] for name in names
+                if name.startswith("ambry-") and not name.endswith(".tmp")]
+            if len(self.ambry_orphans) == 0:
+                return 0, False
+
+        names = self.ambry_orphans[:batch]
+        self.ambry_orphans = self.ambry_orphans[batch:]
+
+        res = await kore.dbquery("db",
+            SQL_AMBRY_ORPHANS,
+            params=[",".join(names)]
+        )
+
+        for row in res:
+            await self.fileio.run(self.ambry_remove, f"ambry-{row['name']}")
+
+        return len(res), len(self.ambry_orphans) > 0
+
+    #
+    # The names of the current walk that are still to be checked.
+    #
+    async def maintenance_ambries_backlog(self, limit):
+        return min(len(self.ambry_orphans), limit)
+
+    async def cathedral_list(self, req):
+        body, etag = await self.cathedrals.get()
+        req.response_header("etag", etag)
+
+        if self.etag_match(req, etag):
+            req.response(304, None)
+            return
+
+        req.response(200, body)
+
+    async def flocks_for_account(self, account, primary=False):
+        res = await self.db.query(
             SQL_NETWORK_LIST,
-            params=[account]
+            params=[account],
+            primary=primary
         )
 
         flocks = []
@@ -306,38 +528,418 @@ class Api:
 
         return net
 
-    async def device_approve_get_kek(self, req, flock, device):
-        devices = await kore.dbquery("db",
-            SQL_DEVICE_LIST_ALL_FOR_NETWORK,
-            params=[flock]
-        )
+    def ambry_length(self, req):
+        length = req.request_header("content-length")
+
+        try:
+            return int(length)
+        except (TypeError, ValueError):
+            return -1
+
+    #
+    # Copy the request body into the ambry store in fixed size
+    # chunks, hashing it along the way, and atomically publish it under
+    # the given name once it is complete.
+    #
+    # Returns None on failure, otherwise if the published ambry changed.
+    #
+    # Kore spools bodies above AMBRY_CHUNK to disk as they arrive, so an
+    # upload never costs more worker memory than the chunk being written
+    # by the file I/O pool and the one read behind it. The price is that
+    # an upload is written twice, once to Kore's spool file and once to
+    # the store, Kore has no way to hand over its spool file instead.
+    # Reading the spool file back is done by Kore on the event loop,
+    # see body_read_exact().
+    #
+    async def ambry_store(self, req, name, length):
+        fd = -1
+        total = 0
+        pending = None
+        digest = hashlib.sha256()
+        src = await self.fileio.run(self.ambry_spool, name)
+
+        try:
+            fd = await self.fileio.run(os.open, src,
+                os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+
+            while True:
+                ret, chunk = req.body_read(AMBRY_CHUNK)
+                if ret == 0:
+                    break
+
+                if pending is not None:
+                    await self.fileio.wait(pending)
+
+                pending = self.fileio.submit(pwrite, fd, chunk, total)
+                total += ret
+                digest.update(chunk)
+
+            if pending is not None:
+                await self.fileio.wait(pending)
 
-        keks = [True] * 256
-        keks[0] = False
+            if total != length:
+                await self.fileio.run(self.ambry_discard, fd, src)
+                return None
 
-        for d in devices:
-            kek = int(d["device_kek"])
-            keks[kek] = False
+            os.close(fd)
+            fd = -1
 
-        kek = None
-        for idx, available in enumerate(keks):
-            if available:
-                kek_db = f"{idx}"
-                kek = f"{idx:02x}"
+            changed = await self.fileio.run(self.ambry_publish,
+                src, name, digest.hexdigest())
+        except Exception as e:
+            kore.log(kore.LOG_NOTICE, f"failed to store {name}: {e}")
+            if pending is not None:
+                await self.fileio.settle(pending)
+            await self.fileio.run(self.ambry_discard, fd, src)
+            return None
+
+        return changed
+
+    def ambry_discard(self, fd, src):
+        if fd != -1:
+            os.close(fd)
+
+        try:
+            os.unlink(src)
+        except FileNotFoundError:
+            pass
+
+    #
+    # Ambries live in a content addressed store as objects/<sha256>, the
+    # published names under the ambry directory are hardlinks into it.
+    # Spool files are created inside the store so they can be renamed
+    # into it, which requires the store to be on the same filesystem
+    # as the ambry directory.
+    #
+    def ambry_spool(self, name):
+        os.makedirs(f"{self.ambry_store_path}/objects", exist_ok=True)
+        return f"{self.ambry_store_path}/{name}.{secrets.token_hex(8)}.tmp"
+
+    #
+    # Publish the spooled file src under name. If the name already
+    # points at this exact content nothing is touched, so replication
+    # never sees a change for an identical upload. Otherwise the object
+    # is added to the store (unless some other name already has it),
+    # hardlinked next to the published name and renamed over it.
+    #
+    # Every published version also gets a reference under refs/<name>/,
+    # of which only AMBRY_HISTORY are kept for rolling back.
+    #
+    def ambry_publish(self, src, name, digest):
+        obj = f"{self.ambry_store_path}/objects/{digest}"
+        dst = f"{self.ambry_path}/{name}"
+
+        try:
+            if os.stat(obj).st_ino == os.stat(dst).st_ino:
+                os.unlink(src)
+                return False
+        except FileNotFoundError:
+            pass
+
+        try:
+            os.link(src, obj)
+        except FileExistsError:
+            pass
+
+        os.unlink(src)
+
+        tmp = f"{dst}.{secrets.token_hex(8)}.tmp"
+        os.link(obj, tmp)
+        os.rename(tmp, dst)
+
+        self.ambry_etag_set(dst, os.stat(dst), digest)
+
+        refs = f"{self.ambry_store_path}/refs/{name}"
+        os.makedirs(refs, exist_ok=True)
+        os.link(obj, f"{refs}/{time.time_ns():020d}-{digest}")
+
+        self.ambry_history_prune(refs, AMBRY_HISTORY)
+
+        return True
+
+    def ambry_remove(self, name):
+        refs = f"{self.ambry_store_path}/refs/{name}"
+
+        try:
+            os.unlink(f"{self.ambry_path}/{name}")
+        except FileNotFoundError:
+            pass
+
+        self.etags.pop(f"{self.ambry_path}/{name}", None)
+
+        if os.path.isdir(refs):
+            self.ambry_history_prune(refs, 0)
+
+            # An upload racing with us may have added a new version.
+            try:
+                os.rmdir(refs)
+            except OSError:
+                pass
+
+    #
+    # Drop the oldest references beyond keep. An object is only
+    # removed once its last reference is gone, its link count then
+    # being down to the store entry itself.
+    #
+    # Publishes of the same name can prune concurrently, so a reference
+    # or object may already be gone.
+    #
+    def ambry_history_prune(self, refs, keep):
+        try:
+            versions = sorted(os.listdir(refs))
+        except FileNotFoundError:
+            return
+
+        for ref in versions[:max(0, len(versions) - keep)]:
+            digest = ref.split("-", 1)[1]
+            obj = f"{self.ambry_store_path}/objects/{digest}"
+
+            try:
+                os.unlink(f"{refs}/{ref}")
+            except FileNotFoundError:
+                pass
+
+            try:
+                if os.stat(obj).st_nlink == 1:
+                    os.unlink(obj)
+            except FileNotFoundError:
+                pass
+
+    #
+    # Reads from the request body stay on the event loop, for a body
+    # Kore spooled to disk they are a read() on its spool file that
+    # cannot be handed to the file I/O pool, the request belongs to
+    # the Kore event loop and its spool file is not exposed.
+    #
+    def body_read_exact(self, req, length):
+        data = b""
+
+        while len(data) < length:
+            ret, chunk = req.body_read(length - len(data))
+            if ret == 0:
+                return None
+            data += chunk
+
+        return data
+
+    #
+    # Rebuild an ambry from its current version and the changed blocks
+    # in the request body, verify the result against the full hash the
+    # client expects and only then publish it.
+    #
+    # Returns the HTTP status and if the published ambry changed.
+    #
+    async def ambry_delta_apply(self, req, name, base, result, blocks,
+        length):
+        fd = -1
+        path = f"{self.ambry_path}/{name}"
+
+        try:
+            cur = await self.fileio.run(open, path, "rb")
+        except FileNotFoundError:
+            return 404, False
+
+        with cur:
+            etag, hashes = await self.fileio.run(self.ambry_hashes,
+                path, cur, True)
+            if etag != f'"{base}"':
+                return 409, False
+
+            size = os.fstat(cur.fileno()).st_size
+
+            if blocks != sorted(set(blocks)):
+                return 400, False
+
+            if len(blocks) == 0 or blocks[0] < 0 or blocks[-1] >= len(hashes):
+                return 400, False
+
+            expected = 0
+            for idx in blocks:
+                expected += min(AMBRY_CHUNK, size - (idx * AMBRY_CHUNK))
+
+            if expected != length:
+                return 400, False
+
+            src = await self.fileio.run(self.ambry_spool, name)
+
+            try:
+                fd = await self.fileio.run(self.ambry_copy, cur, src)
+
+                for idx in blocks:
+                    want = min(AMBRY_CHUNK, size - (idx * AMBRY_CHUNK))
+                    data = self.body_read_exact(req, want)
+                    if data is None:
+                        raise RuntimeError("short delta body")
+                    await self.fileio.run(pwrite,
+                        fd, data, idx * AMBRY_CHUNK)
+
+                digest = await self.fileio.run(self.ambry_digest, fd)
+
+                os.close(fd)
+                fd = -1
+
+                if digest != result:
+                    await self.fileio.run(self.ambry_discard, fd, src)
+                    return 400, False
+
+                changed = await self.fileio.run(self.ambry_publish,
+                    src, name, result)
+            except Exception as e:
+                kore.log(kore.LOG_NOTICE, f"failed to apply {name}: {e}")
+                await self.fileio.run(self.ambry_discard, fd, src)
+                return 400, False
+
+        return 200, changed
+
+    def ambry_copy(self, f, dst):
+        offset = 0
+        fd = os.open(dst, os.O_CREAT | os.O_EXCL | os.O_RDWR, 0o644)
+
+        try:
+            while True:
+                chunk = f.read(AMBRY_CHUNK)
+                if not chunk:
+                    break
+                pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        except Exception:
+            os.close(fd)
+            raise
+
+        return fd
+
+    def ambry_digest(self, fd):
+        offset = 0
+        digest = hashlib.sha256()
+
+        while True:
+            chunk = os.pread(fd, AMBRY_CHUNK, offset)
+            if not chunk:
                 break
+            digest.update(chunk)
+            offset += len(chunk)
+
+        return digest.hexdigest()
+
+    def etag_match(self, req, etag):
+        match = req.request_header("if-none-match")
+        if match is None:
+            return False
+
+        for candidate in match.split(","):
+            candidate = candidate.strip()
+            if candidate == etag or candidate == "*":
+                return True
+
+        return False
+
+    def ambry_etag_set(self, path, st, digest, blocks=None):
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        self.etags[path] = (key, f'"{digest}"', blocks)
+
+    #
+    # Strong ETag for an ambry, the SHA-256 of its contents, and the
+    # SHA-256 of each AMBRY_CHUNK sized block for delta uploads. Uploads
+    # prime the cache, other workers hash the file once per version.
+    #
+    def ambry_hashes(self, path, f, blocks=False):
+        st = os.fstat(f.fileno())
+        cached = self.etags.get(path)
+
+        if cached is not None:
+            key, etag, hashes = cached
+            if key == (st.st_ino, st.st_mtime_ns, st.st_size):
+                if blocks is False or hashes is not None:
+                    return etag, hashes
+
+        hashes = []
+        digest = hashlib.sha256()
+
+        while True:
+            chunk = f.read(AMBRY_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+            hashes.append(hashlib.sha256(chunk).hexdigest())
+
+        f.seek(0)
+        self.ambry_etag_set(path, st, digest.hexdigest(), hashes)
+
+        return self.etags[path][1], hashes
+
+    #
+    # Kore pulls the chunks from the event loop, so the next chunk is
+    # already read on the file I/O pool while the current one is sent
+    # and the loop only waits on the disk when it falls behind the
+    # client.
+    #
+    def ambry_stream(self, f):
+        offset = 0
+        fd = f.fileno()
+        pending = self.fileio.submit(os.pread, fd, AMBRY_CHUNK, offset)
+
+        with f:
+            try:
+                while True:
+                    chunk = pending.result()
+                    if not chunk:
+                        break
+
+                    offset += len(chunk)
+                    pending = self.fileio.submit(os.pread,
+                        fd, AMBRY_CHUNK, offset)
+
+                    yield chunk
+            finally:
+                concurrent.futures.wait([pending])
+
+    async def ambry_serve(self, req, name):
+        path = f"{self.ambry_path}/{name}"
+
+        try:
+            f = await self.fileio.run(open, path, "rb")
+        except FileNotFoundError:
+            req.response(404, None)
+            return
+
+        etag, _ = await self.fileio.run(self.ambry_hashes, path, f)
+        req.response_header("etag", etag)
+
+        if self.etag_match(req, etag):
+            f.close()
+            req.response(304, None)
+            return
 
-        if kek is None:
+        req.response_header("content-type", "application/octet-stream")
+        req.response(200, self.ambry_stream(f))
+
+    #
+    # The KEK is picked and claimed by SQL_DEVICE_APPROVE in one go,
+    # a unique index on (flock, kek) makes a concurrent approval that
+    # picked the same slot fail, in which case we try again.
+    #
+    async def device_approve_get_kek(self, req, flock, device):
+        for attempt in range(KEK_ATTEMPTS):
+            try:
+                res = await kore.dbquery("db",
+                    SQL_DEVICE_APPROVE,
+                    params=[flock, device, req.account]
+                )
+                break
+            except Exception as e:
+                if "devices_network_kek_idx" not in str(e):
+                    raise
+                if attempt == KEK_ATTEMPTS - 1:
+                    return (False, "Failed to allocate a KEK, try again")
+
+        if res[0]["free"] is None:
             msg = "No available KEKs left in flock"
             return (False, msg)
 
-        res = await kore.dbquery("db",
-            SQL_DEVICE_APPROVE,
-            params=[flock, device, kek_db]
-        )
-
-        if len(res) != 1:
+        if res[0]["kek"] is None:
             msg = f"{device} not found or already approved"
         else:
+            kek = f"{int(res[0]['kek']):02x}"
             msg = f"{device} approved, please supply it with {flock}/kek-data/kek-0x{kek}"
 
         return (True, msg)
@@ -373,6 +975,10 @@ class Api:
         req.response(200, json.dumps(resp).encode())
 
     async def init(self, req):
+        if req.body is None:
+            req.response(400, None)
+            return
+
         if len(req.body) != 0 and len(req.body) != 64:
             req.response(400, None)
             return
@@ -413,7 +1019,7 @@ class Api:
         req.response(200, json.dumps(resp).encode())
 
     async def flock_create(self, req):
-        flocks = await self.flocks_for_account(req.account)
+        flocks = await self.flocks_for_account(req.account, primary=True)
         if len(flocks) >= req.account_max_flocks:
             req.response(200, b'reached max flocks per account')
             return
@@ -425,6 +1031,8 @@ class Api:
             params=[net, req.account]
         )
 
+        self.flock_filter.add(net)
+
         req.response(200, net.encode())
 
     async def flock_list(self, req):
@@ -445,26 +1053,38 @@ class Api:
         if len(res) != 1:
             req.response(403, None)
         else:
+            self.flock_filter.remove(network)
             req.response(200, b'deleted')
 
+    #
+    # Unknown flocks get a made up device so the endpoint cannot be
+    # used to find out which flocks exist.
+    #
+    def device_create_decoy(self, req, flock):
+        resp = {
+            "cathedral_id": secrets.token_hex(4),
+            "cathedral_secret": secrets.token_hex(32),
+            "flock": flock
+        }
+
+        req.response(200, json.dumps(resp).encode())
+
     async def device_create(self, req, flock):
-        if len(req.body) != 32:
+        if req.body is None or len(req.body) != 32:
             req.response(400, b'invalid cosk')
             return
 
+        if not self.flock_filter.maybe(flock):
+            self.device_create_decoy(req, flock)
+            return
+
         net = await kore.dbquery("db",
             SQL_NETWORK_GET_UNAUTHED,
             params=[flock]
         )
 
         if len(net) != 1:
-            resp = {
-                "cathedral_id": secrets.token_hex(4),
-                "cathedral_secret": secrets.token_hex(32),
-                "flock": flock
-            }
-
-            req.response(200, json.dumps(resp).encode())
+            self.device_create_decoy(req, flock)
             return
 
         netid = net[0]["network_id"]
@@ -489,7 +1109,7 @@ class Api:
         if await self.flock_exists_for_account(req, flock) is None:
             return
 
-        res = await kore.dbquery("db",
+        res = await self.db.query(
             SQL_DEVICE_LIST,
             params=[flock, req.account]
         )
@@ -521,6 +1141,9 @@ class Api:
         req.response(200, msg.encode())
 
     async def device_approve(self, req, flock, device):
+        if await self.flock_exists_for_account(req, flock) is None:
+            return
+
         result, msg = await self.device_approve_get_kek(req, flock, device)
 
         if result is False:
@@ -529,27 +1152,225 @@ class Api:
 
         req.response(200, msg.encode())
 
-    async def ambry_upload(self, req, flock):
+    #
+    # The batch device endpoints take whitespace separated device ids,
+    # or cosk public keys in hex for enroll, as their body and answer
+    # with a result per item. Each batch is one statement.
+    #
+    def device_batch(self, req, pattern):
+        if req.body is None:
+            return None
+
+        try:
+            items = req.body.decode().split()
+        except UnicodeDecodeError:
+            return None
+
+        if len(items) == 0 or len(items) > DEVICE_BATCH_MAX:
+            return None
+
+        for item in items:
+            if not pattern.match(item):
+                return None
+
+        return items
+
+    async def device_approve_batch(self, req, flock):
+        devices = self.device_batch(req, self.device_id)
+        if devices is None:
+            req.response(400, b'invalid device list')
+            return
+
         if await self.flock_exists_for_account(req, flock) is None:
             return
 
-        src = f"{self.ambry_path}/ambry-{flock}.tmp"
+        for attempt in range(KEK_ATTEMPTS):
+            try:
+                res = await kore.dbquery("db",
+                    SQL_DEVICE_APPROVE_BATCH,
+                    params=[flock, ",".join(devices), req.account]
+                )
+                break
+            except Exception as e:
+                if "devices_network_kek_idx" not in str(e):
+                    raise
+                if attempt == KEK_ATTEMPTS - 1:
+                    req.response(503, b'failed to allocate KEKs, try again')
+                    return
+
+        results = []
+        for row in res:
+            if row["kek"] is not None:
+                kek = f"{int(row['kek']):02x}"
+                result = {
+                    "device": row["device"],
+                    "status": "approved",
+                    "kek": f"kek-0x{kek}"
+                }
+            elif row["pending"] == "t":
+                result = {"device": row["device"], "status": "no kek left"}
+            else:
+                result = {
+                    "device": row["device"],
+                    "status": "not found or already approved"
+                }
+            results.append(result)
+
+        req.response(200, json.dumps({"devices": results}).encode())
+
+    async def device_delete_batch(self, req, flock):
+        devices = self.device_batch(req, self.device_id)
+        if devices is None:
+            req.response(400, b'invalid device list')
+            return
 
-        if len(req.body) != 7542970 and len(req.body) != 3756730:
-            req.response(403, None)
+        if await self.flock_exists_for_account(req, flock) is None:
             return
 
-        with open(src, "wb") as f:
-            f.write(req.body)
+        res = await kore.dbquery("db",
+            SQL_DEVICE_DELETE_BATCH,
+            params=[flock, ",".join(devices), req.account]
+        )
+
+        results = []
+        for row in res:
+            if row["deleted"] == "t":
+                status = "deleted"
+            else:
+                status = "does not exist"
+            results.append({"device": row["device"], "status": status})
 
-        dst = f"{self.ambry_path}/ambry-{flock}"
-        os.rename(src, dst)
+        req.response(200, json.dumps({"devices": results}).encode())
+
+    async def device_enroll(self, req, flock):
+        cosks = self.device_batch(req, self.device_cosk)
+        if cosks is None:
+            req.response(400, b'invalid cosk list')
+            return
+
+        net = await self.flock_exists_for_account(req, flock)
+        if net is None:
+            return
+
+        ids = []
+        keys = []
+        results = []
+
+        for cosk in cosks:
+            device = secrets.token_hex(4)
+            key = secrets.token_hex(32)
+
+            ids.append(device)
+            keys.append(key)
+            results.append({
+                "cathedral_id": device,
+                "cathedral_secret": key,
+                "flock": flock
+            })
 
         await kore.dbquery("db",
-            SQL_NETWORK_AMBRY_UPDATE,
-            params=[flock, req.account]
+            SQL_DEVICE_CREATE_BATCH,
+            params=[net[0]["network_id"], req.account, flock,
+                ",".join(ids), ",".join(keys), ",".join(cosks)]
         )
 
+        req.response(200, json.dumps({"devices": results}).encode())
+
+    async def ambry(self, req, flock):
+        if req.method == kore.HTTP_METHOD_GET:
+            await self.ambry_download(req, flock)
+        else:
+            await self.ambry_upload(req, flock)
+
+    async def ambry_download(self, req, flock):
+        if await self.flock_exists_for_account(req, flock) is None:
+            return
+
+        await self.ambry_serve(req, f"ambry-{flock}")
+
+    async def ambry_blocks(self, req, flock):
+        if await self.flock_exists_for_account(req, flock) is None:
+            return
+
+        path = f"{self.ambry_path}/ambry-{flock}"
+
+        try:
+            f = await self.fileio.run(open, path, "rb")
+        except FileNotFoundError:
+            req.response(404, None)
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            etag, hashes = await self.fileio.run(self.ambry_hashes,
+                path, f, True)
+
+        resp = {
+            "size": size,
+            "block": AMBRY_CHUNK,
+            "sha256": etag.strip('"'),
+            "blocks": hashes
+        }
+
+        req.response_header("etag", etag)
+        req.response(200, json.dumps(resp).encode())
+
+    async def ambry_delta(self, req, flock):
+        length = self.ambry_length(req)
+        base = req.request_header("x-ambry-base")
+        result = req.request_header("x-ambry-sha256")
+        indices = req.request_header("x-ambry-blocks")
+
+        if base is None or result is None or indices is None:
+            req.response(400, None)
+            return
+
+        try:
+            blocks = [int(idx) for idx in indices.split(",")]
+        except ValueError:
+            req.response(400, None)
+            return
+
+        if await self.flock_exists_for_account(req, flock) is None:
+            return
+
+        status, changed = await self.ambry_delta_apply(req,
+            f"ambry-{flock}", base, result, blocks, length)
+
+        if status != 200:
+            req.response(status, None)
+            return
+
+        if changed:
+            await kore.dbquery("db",
+                SQL_NETWORK_AMBRY_UPDATE,
+                params=[flock, req.account]
+            )
+
+        req.response(200, b'ambry uploaded')
+
+    async def ambry_upload(self, req, flock):
+        length = self.ambry_length(req)
+
+        if length not in AMBRY_SIZES:
+            req.response(403, None)
+            return
+
+        if await self.flock_exists_for_account(req, flock) is None:
+            return
+
+        changed = await self.ambry_store(req, f"ambry-{flock}", length)
+
+        if changed is None:
+            req.response(400, None)
+            return
+
+        if changed:
+            await kore.dbquery("db",
+                SQL_NETWORK_AMBRY_UPDATE,
+                params=[flock, req.account]
+            )
+
         req.response(200, b'ambry uploaded')
 
     async def account_logout(self, req):
@@ -599,7 +1420,7 @@ class Api:
             req.response(200, tmpl.stream())
 
     async def account(self, req):
-        flocks = await self.flocks_for_account(req.account)
+        flocks = await self.flocks_for_account(req.account, primary=True)
         tmpl = self.templates.get_template("account.html")
         req.response_header("content-type", "text/html; charset=utf-8")
         req.response(200, tmpl.stream({
@@ -630,7 +1451,7 @@ class Api:
         req.response(302, None)
 
     async def account_flock_create(self, req):
-        flocks = await self.flocks_for_account(req.account)
+        flocks = await self.flocks_for_account(req.account, primary=True)
         if len(flocks) < req.account_max_flocks:
             net = secrets.token_hex(7) + "00"
 
@@ -639,6 +1460,8 @@ class Api:
                 params=[net, req.account]
             )
 
+            self.flock_filter.add(net)
+
         req.response_header("location", "/account/")
         req.response(302, None)
 
@@ -648,22 +1471,33 @@ class Api:
             params=[flock, req.account]
         )
 
+        if len(res) == 1:
+            self.flock_filter.remove(flock)
+
         req.response_header("location", "/account/")
         req.response(302, None)
 
     async def account_flock_manage(self, req, flock):
-        if await self.flock_exists_for_account(req, flock, web=True) is None:
-            return
-
-        xfl = await kore.dbquery("db",
-            SQL_XFLOCK_LIST_FOR_FLOCK,
-            params=[flock, req.account]
+        net, xfl, devices = await kore.gather(
+            self.flock_exists_for_account(req, flock, web=True),
+            self.db.query(
+                SQL_XFLOCK_LIST_FOR_FLOCK,
+                params=[flock, req.account],
+                primary=True
+            ),
+            self.db.query(
+                SQL_DEVICE_LIST,
+                params=[flock, req.account],
+                primary=True
+            )
         )
 
-        devices = await kore.dbquery("db",
-            SQL_DEVICE_LIST,
-            params=[flock, req.account]
-        )
+        if net is None:
+            return
+
+        for res in (net, xfl, devices):
+            if isinstance(res, Exception):
+                raise res
 
         for device in devices:
             kek = int(device["device_kek"])
@@ -716,7 +1550,7 @@ class Api:
         req.response(302, None)
 
     async def xflock_list(self, req):
-        xfl = await kore.dbquery("db",
+        xfl = await self.db.query(
             SQL_XFLOCK_LIST,
             params=[req.account]
         )
@@ -728,58 +1562,22 @@ class Api:
         req.response(200, json.dumps(resp).encode())
 
     async def xflock_create(self, req, flock_a, flock_b):
-        src = await self.flock_exists_for_account(req, flock_a)
-        if src is None:
-            return
-
-        dst = await kore.dbquery("db",
-            SQL_NETWORK_GET_OWNER,
-            params=[flock_b]
+        res = await kore.dbquery("db",
+            SQL_XFLOCK_CREATE,
+            params=[flock_a, flock_b, req.account]
         )
 
-        if len(dst) != 1:
+        if res[0]["src"] is None or res[0]["dst"] is None:
             req.response(403, None)
             return
 
-        src_id = src[0]["network_id"]
-        dst_id = dst[0]["network_id"]
-        dst_owner = dst[0]["network_owner"]
-
-        xfl = await kore.dbquery("db",
-            SQL_XFLOCK_GET,
-            params=[src_id, dst_id, req.account]
-        )
-
-        if len(xfl) != 0:
-            xfl = await kore.dbquery("db",
-                SQL_XFLOCK_GET,
-                params=[dst_id, src_id, dst_owner]
-            )
-
-            if len(xfl) == 1:
-                resp = "The xflock is already established"
-            else:
-                resp = "Ask the other party to run:\n" \
-                      f"    $ reliquary-xflock-create {flock_b} {flock_a}"
-
-            req.response(200, resp.encode())
-            return
-
-        await kore.dbquery("db",
-            SQL_XFLOCK_CREATE,
-            params=[src_id, flock_a, dst_id, flock_b, req.account]
-        )
-
-        xfl = await kore.dbquery("db",
-            SQL_XFLOCK_GET,
-            params=[dst_id, src_id, dst_owner]
-        )
-
-        if len(xfl) == 0:
+        if res[0]["mutual"] != "t":
             resp = "Ask the other party to run:\n" \
                   f"    $ reliquary-xflock-create {flock_b} {flock_a}"
-        else:
+        elif res[0]["created"] == "t":
             resp = "The xflock has been established"
+        else:
+            resp = "The xflock is already established"
 
         req.response(200, resp.encode())
 
@@ -795,45 +1593,21 @@ class Api:
 
         req.response(200, b"The xflock binding has been removed")
 
-    async def xflock_ambry_upload(self, req, flock_a, flock_b):
-        if len(req.body) != 7542970:
-            req.response(403, None)
-            return
-
-        src = await self.flock_exists_for_account(req, flock_a)
-        if src is None:
-            return
-
-        dst = await kore.dbquery("db",
-            SQL_NETWORK_GET_OWNER,
-            params=[flock_b]
-        )
-
-        if len(dst) != 1:
-            req.response(403, None)
-            return
-
-        src_id = src[0]["network_id"]
-        dst_id = dst[0]["network_id"]
-        dst_owner = dst[0]["network_owner"]
-
-        xfl = await kore.dbquery("db",
-            SQL_XFLOCK_GET,
-            params=[src_id, dst_id, req.account]
-        )
-
-        if len(xfl) != 1:
-            req.response(403, None)
-            return
+    async def xflock_ambry(self, req, flock_a, flock_b):
+        if req.method == kore.HTTP_METHOD_GET:
+            await self.xflock_ambry_download(req, flock_a, flock_b)
+        else:
+            await self.xflock_ambry_upload(req, flock_a, flock_b)
 
-        xfl = await kore.dbquery("db",
-            SQL_XFLOCK_GET,
-            params=[dst_id, src_id, dst_owner]
+    async def xflock_ambry_name(self, req, flock_a, flock_b):
+        res = await kore.dbquery("db",
+            SQL_XFLOCK_ACCESS,
+            params=[flock_a, flock_b, req.account]
         )
 
-        if len(xfl) != 1:
+        if res[0]["owned"] != "t" or res[0]["mutual"] != "t":
             req.response(403, None)
-            return
+            return None
 
         a_id = int(flock_a, 16)
         b_id = int(flock_b, 16)
@@ -843,13 +1617,29 @@ class Api:
             flock_a = flock_b
             flock_b = tmp
 
-        src = f"{self.ambry_path}/ambry-{flock_a}_{flock_b}.tmp"
+        return f"ambry-{flock_a}_{flock_b}"
+
+    async def xflock_ambry_download(self, req, flock_a, flock_b):
+        name = await self.xflock_ambry_name(req, flock_a, flock_b)
+        if name is None:
+            return
+
+        await self.ambry_serve(req, name)
+
+    async def xflock_ambry_upload(self, req, flock_a, flock_b):
+        length = self.ambry_length(req)
+
+        if length != AMBRY_SIZES[0]:
+            req.response(403, None)
+            return
 
-        with open(src, "wb") as f:
-            f.write(req.body)
+        name = await self.xflock_ambry_name(req, flock_a, flock_b)
+        if name is None:
+            return
 
-        dst = f"{self.ambry_path}/ambry-{flock_a}_{flock_b}"
-        os.rename(src, dst)
+        if await self.ambry_store(req, name, length) is None:
+            req.response(400, None)
+            return
 
         req.response(200, b'ambry uploaded')
 
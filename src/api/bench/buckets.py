@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Rate limiter cost under a flood of distinct client addresses, the old
+# list per client against the token buckets of ratelimit.RateLimit.
+#
+# Reports the time per check and how much Python memory the limiter
+# holds on to once every address has been seen, the shared table of
+# the token buckets is a fixed size mapping on top of that.
+#
+#   $ python3 src/api/bench/buckets.py [clients]
+#
+
+import sys
+import time
+import tracemalloc
+
+import korestub
+
+from ratelimit import RateLimit, RATELIMIT_WAYS, RATELIMIT_SLOT
+
+CLIENTS = 1000000
+SETS = 65536
+
+#
+# The limiter before token buckets, without its expiry task.
+#
+class ListRateLimit:
+    def __init__(self):
+        self.clients = {}
+
+    def check(self, client, path):
+        if not client in self.clients:
+            self.clients[client] = []
+
+        bucket = self.clients[client]
+
+        if len(bucket) > 1:
+            return False
+
+        bucket.append(path)
+
+        return True
+
+def address(idx):
+    return f"10.{(idx >> 16) & 0xff}.{(idx >> 8) & 0xff}.{idx & 0xff}"
+
+def run(factory, clients, route):
+    limiter = factory()
+    start = time.perf_counter()
+
+    for idx in range(clients):
+        limiter.check(address(idx), route)
+
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    limiter = factory()
+
+    for idx in range(clients):
+        limiter.check(address(idx), route)
+
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return elapsed / clients * 1e6, held
+
+def main():
+    clients = CLIENTS
+
+    if len(sys.argv) == 2:
+        clients = int(sys.argv[1])
+
+    before = run(ListRateLimit, clients, "/v1/flock/list")
+    after = run(lambda: RateLimit(None, SETS), clients, "default")
+    table = SETS * RATELIMIT_WAYS * RATELIMIT_SLOT.size
+
+    print(f"{clients} distinct clients")
+    print(f"list:    {before[0]:.2f} us/check, {before[1] / 1e6:.1f} MB held")
+    print(f"buckets: {after[0]:.2f} us/check, {after[1] / 1e6:.1f} MB held, "
+        f"{table / 1e6:.1f} MB shared table")
+
+if __name__ == "__main__":
+    main()
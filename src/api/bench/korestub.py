@@ -0,0 +1,201 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Just enough of the kore module for the benchmarks to import the API
+# and sync modules outside of Kore. Importing this registers it as kore
+# and puts src/api on the path.
+#
+# Coroutines run on asyncio, suspend() sleeps on its loop. There is no
+# database and dbquery() always fails unless pgsql() was called, which
+# runs the queries on the databases from dbsetup() through psycopg2.
+#
+# Routes and pre-request hooks are recorded so a benchmark can push a
+# request through them the way Kore would, see route().
+#
+
+import os
+import re
+import sys
+import types
+import asyncio
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LOG_INFO = 6
+LOG_NOTICE = 5
+
+HTTP_METHOD_GET = 1
+HTTP_METHOD_POST = 2
+
+PGSQL_CONN_MAX = 2
+
+config = types.SimpleNamespace()
+
+application = None
+psycopg2 = None
+
+hooks = []
+routes = []
+pools = {}
+databases = {}
+
+class Domain:
+    def route(self, path, handler, methods=None, **kwargs):
+        routes.append((path, handler, methods))
+
+def app(obj=None):
+    global application
+
+    if obj is not None:
+        application = obj
+
+    return application
+
+def prerequest(func):
+    hooks.append(func)
+    return func
+
+def log(level, msg):
+    pass
+
+def server(*args, **kwargs):
+    pass
+
+def domain(*args, **kwargs):
+    return Domain()
+
+def privsep(*args, **kwargs):
+    pass
+
+def dbsetup(name, conninfo):
+    databases[name] = conninfo
+
+async def dbquery(db, sql, params=None):
+    raise RuntimeError("no database outside of kore")
+
+#
+# The handler for a path and the arguments it is called with, exact
+# paths first like Kore does, then the regex routes in order.
+#
+def route(path):
+    for pattern, handler, methods in routes:
+        if pattern == path:
+            return handler, ()
+
+    for pattern, handler, methods in routes:
+        if not pattern.startswith("^"):
+            continue
+        match = re.match(pattern, path)
+        if match is not None:
+            return handler, match.groups()
+
+    return None, ()
+
+#
+# Answers dbquery() from PostgreSQL over asynchronous psycopg2
+# connections, at most PGSQL_CONN_MAX per database and event loop like
+# Kore keeps per worker. Rows come back as dicts of strings the way
+# Kore hands them out, NULL as None.
+#
+def pgsql():
+    global dbquery, psycopg2
+
+    import psycopg2
+    import psycopg2.extensions
+
+    text = psycopg2.extensions.new_type(
+        (16, 17, 20, 21, 23, 26, 700, 701, 1082, 1083, 1114, 1184, 1186,
+            1266, 1700),
+        "KORETEXT", lambda value, cur: value
+    )
+    psycopg2.extensions.register_type(text)
+
+    dbquery = pgsql_query
+
+async def pgsql_poll(conn):
+    loop = asyncio.get_running_loop()
+
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+
+        fd = conn.fileno()
+        ready = loop.create_future()
+        wake = lambda: ready.done() or ready.set_result(None)
+
+        if state == psycopg2.extensions.POLL_READ:
+            loop.add_reader(fd, wake)
+        else:
+            loop.add_writer(fd, wake)
+
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+            loop.remove_writer(fd)
+
+async def pgsql_query(db, sql, params=None):
+    key = (db, asyncio.get_running_loop())
+    pool = pools.get(key)
+
+    if pool is None:
+        pool = types.SimpleNamespace(
+            slots=asyncio.Semaphore(PGSQL_CONN_MAX), idle=[]
+        )
+        pools[key] = pool
+
+    args = None
+    if params is not None:
+        args = {f"{idx}": value.decode() if isinstance(value, bytes)
+            else value for idx, value in enumerate(params, 1)}
+        sql = re.sub("\\$([0-9]+)", "%(\\1)s", sql.replace("%", "%%"))
+
+    async with pool.slots:
+        if len(pool.idle) > 0:
+            conn = pool.idle.pop()
+        else:
+            conn = psycopg2.connect(databases[db], async_=1)
+            await pgsql_poll(conn)
+
+        try:
+            cur = conn.cursor()
+            cur.execute(sql, args)
+            await pgsql_poll(conn)
+
+            if cur.description is None:
+                return []
+
+            names = [column.name for column in cur.description]
+            return [dict(zip(names, row)) for row in cur.fetchall()]
+        finally:
+            if not conn.closed:
+                pool.idle.append(conn)
+
+async def suspend(ms):
+    await asyncio.sleep(ms / 1000)
+
+async def gather(*coros):
+    return await asyncio.gather(*coros, return_exceptions=True)
+
+def task_create(coro):
+    try:
+        return asyncio.get_running_loop().create_task(coro)
+    except RuntimeError:
+        coro.close()
+
+sys.modules.setdefault("kore", sys.modules[__name__])
+sys.path.insert(0, API)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Requests per second of the API against a local PostgreSQL for a
+# growing number of workers.
+#
+# The API is configured once and forked, like Kore does, so the rate
+# limiter and flock filter are shared. Every worker then runs a number
+# of clients that push authenticated requests for the flock list, the
+# device list of their flock and the xflock list through the recorded
+# pre-request hooks and routes, with their queries going to the
+# database through korestub.pgsql().
+#
+# Every request comes from a different address so the rate limiter is
+# checked but never hit. Anything but a 200 is counted as an error.
+#
+# The database is built like tests/explain.py does it, with a flock
+# and five approved devices per account on top.
+#
+#   $ DBHOST=/var/run/postgresql python3 src/api/bench/load.py [seconds]
+#
+
+import os
+import sys
+import time
+import types
+import asyncio
+import multiprocessing
+
+import korestub
+
+sys.path.insert(0, f"{korestub.API}/tests")
+
+import explain
+
+from api import Api
+
+CLIENTS = 16
+WORKERS = [1, 2, 4, 8]
+
+SQL_FIXTURES = [
+    f"""
+    INSERT INTO networks (network_token, network_owner, network_ambry_update)
+    SELECT
+        lpad(to_hex(i), 16, '0'), i, 1
+    FROM
+        generate_series(1, {explain.ACCOUNTS}) AS i
+    """,
+    """
+    INSERT INTO devices
+        (device_kek, device_cathedral_id, device_cathedral_key,
+        device_network, device_account, device_network_token,
+        device_approved)
+    SELECT
+        d, lpad(to_hex(268435456 + n.network_id * 8 + d), 8, '0'), 'key',
+        n.network_id, n.network_owner, n.network_token, 't'
+    FROM
+        networks n, generate_series(1, 5) AS d
+    WHERE
+        n.network_token NOT LIKE 'flock-%'
+    """,
+    "DELETE FROM flock_changes",
+]
+
+class Request:
+    def __init__(self, path, addr, token):
+        self.path = path
+        self.status = None
+        self.method = korestub.HTTP_METHOD_GET
+        self.headers = {"x-token": token}
+        self.connection = types.SimpleNamespace(addr=addr)
+
+    def request_header(self, name):
+        return self.headers.get(name)
+
+    def response_header(self, name, value):
+        pass
+
+    def response(self, status, body):
+        self.status = status
+
+#
+# Runs a request through the pre-request hooks and its route, any hook
+# that returns False has answered it already.
+#
+async def dispatch(req):
+    for hook in korestub.hooks:
+        ret = hook(req)
+        if asyncio.iscoroutine(ret):
+            ret = await ret
+        if ret is False:
+            return req.status
+
+    handler, args = korestub.route(req.path)
+    ret = handler(req, *args)
+    if asyncio.iscoroutine(ret):
+        await ret
+
+    return req.status
+
+#
+# Accounts with a valid token, tok-N belongs to account N + 1 and both
+# every 100th token and every 100th account are expired.
+#
+def accounts():
+    return [account for account in range(2, explain.ACCOUNTS + 1)
+        if (account - 1) % 100 != 0 and account % 100 != 0]
+
+async def client(wid, cid, end, state):
+    live = accounts()
+    account = live[(wid * CLIENTS + cid) * 97 % len(live)]
+    token = f"tok-{account - 1}"
+
+    paths = [
+        "/v1/flock/list",
+        f"/v1/device/list/{account:016x}",
+        "/v1/xflock/list",
+    ]
+
+    while time.monotonic() < end:
+        n = state["sent"]
+        state["sent"] += 1
+
+        addr = f"10.{wid}.{(n >> 8) & 255}.{n & 255}"
+        req = Request(paths[n % len(paths)], addr, token)
+
+        if await dispatch(req) != 200:
+            state["errors"] += 1
+
+        state["requests"] += 1
+
+async def load(wid, seconds):
+    state = {"sent": 0, "requests": 0, "errors": 0}
+    end = time.monotonic() + seconds
+
+    await asyncio.gather(*[client(wid, cid, end, state)
+        for cid in range(CLIENTS)])
+
+    return state["requests"], state["errors"]
+
+def worker(wid, seconds, results):
+    results.put(asyncio.run(load(wid, seconds)))
+
+def run(count, seconds):
+    ctx = multiprocessing.get_context("fork")
+    results = ctx.Queue()
+
+    procs = [ctx.Process(target=worker, args=(wid, seconds, results))
+        for wid in range(count)]
+
+    for proc in procs:
+        proc.start()
+
+    requests = 0
+    errors = 0
+
+    for _ in procs:
+        done, failed = results.get()
+        requests += done
+        errors += failed
+
+    for proc in procs:
+        proc.join()
+
+    return requests / seconds, errors
+
+def main():
+    seconds = 5
+
+    if len(sys.argv) == 2:
+        seconds = int(sys.argv[1])
+
+    dbhost = os.getenv("DBHOST", default="/var/run/postgresql")
+    dbname = os.getenv("BENCH_DB", default="reliquary_bench")
+
+    conn = explain.setup(dbhost, dbname)
+    cur = conn.cursor()
+
+    for sql in SQL_FIXTURES:
+        cur.execute(sql)
+    conn.commit()
+    conn.close()
+
+    korestub.pgsql()
+
+    app = Api()
+    app.configure([])
+    korestub.dbsetup("db", f"host={dbhost} dbname={dbname}")
+
+    print(f"{CLIENTS} clients per worker for {seconds}s")
+
+    for count in WORKERS:
+        rps, errors = run(count, seconds)
+        print(f"{count} workers: {rps:>8.0f} req/s, {errors} errors")
+
+if __name__ == "__main__":
+    main()
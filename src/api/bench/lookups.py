@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Latency of the per-request lookups against a local PostgreSQL:
+#
+#   plain      the statement text sent and planned on every call, as
+#              the API did before 0006-hot-lookups.sql
+#   function   the PL/pgSQL functions from 0006 the API calls now
+#   prepared   a server side prepared statement, for reference, Kore
+#              has no API for these
+#
+# Every lookup is reported as the latency seen by the client and the
+# CPU time the database backend spent on it, taken from /proc/<pid>/stat
+# of the backend, so the server has to run on the same host.
+#
+# The database is built like tests/explain.py does it.
+#
+#   $ DBHOST=/var/run/postgresql python3 src/api/bench/lookups.py
+#
+
+import os
+import re
+import sys
+import time
+
+import korestub
+
+sys.path.insert(0, f"{korestub.API}/tests")
+
+import explain
+
+from queries import SQL_ACCOUNT_FROM_TOKEN, SQL_NETWORK_GET
+
+ITERATIONS = 10000
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+SQL_ACCOUNT_FROM_TOKEN_PLAIN = """
+SELECT
+    account_id, account_time_left, account_key, account_flocks_max,
+    token_expires
+FROM
+    tokens
+JOIN
+    accounts ON accounts.account_id = tokens.token_account
+WHERE
+    token_value = $1 AND token_web = $2 AND
+    token_expires > EXTRACT(epoch FROM now())
+"""
+
+SQL_NETWORK_GET_PLAIN = """
+SELECT
+    network_id, network_token
+FROM
+    networks
+WHERE
+    network_token = $1 AND network_owner = $2
+"""
+
+LOOKUPS = [
+    ("account-from-token", SQL_ACCOUNT_FROM_TOKEN_PLAIN,
+        SQL_ACCOUNT_FROM_TOKEN, lambda idx: [f"tok-{idx}", "f"]),
+    ("network-get", SQL_NETWORK_GET_PLAIN,
+        SQL_NETWORK_GET, lambda idx: [f"flock-{idx}", f"{idx % 20000 + 1}"]),
+]
+
+def pyformat(sql):
+    return re.sub("\\$[0-9]+", "%s", sql)
+
+#
+# User and system CPU time of a process in seconds, fields 14 and 15 of
+# its stat file, counted after the command name that may hold spaces.
+#
+def cputime(pid):
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def measure(cur, backend, sql, params):
+    for idx in range(1, 100):
+        cur.execute(sql, params(idx))
+        cur.fetchall()
+
+    cpu = cputime(backend)
+    start = time.perf_counter()
+
+    for idx in range(1, ITERATIONS + 1):
+        cur.execute(sql, params(idx))
+        cur.fetchall()
+
+    elapsed = time.perf_counter() - start
+    cpu = cputime(backend) - cpu
+
+    return elapsed / ITERATIONS * 1e6, cpu / ITERATIONS * 1e6
+
+def main():
+    dbhost = os.getenv("DBHOST", default="/var/run/postgresql")
+    dbname = os.getenv("BENCH_DB", default="reliquary_bench")
+
+    conn = explain.setup(dbhost, dbname)
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    cur.execute("SELECT pg_backend_pid()")
+    backend = cur.fetchone()[0]
+
+    print("latency / database CPU per lookup, in us")
+    print(f"{'lookup':<20} {'plain':>12} {'function':>12} {'prepared':>12}")
+
+    for name, plain, function, params in LOOKUPS:
+        args = ", ".join(["%s"] * len(params(1)))
+        cur.execute(f"PREPARE lookup AS {plain}")
+
+        results = [
+            measure(cur, backend, pyformat(plain), params),
+            measure(cur, backend, pyformat(function), params),
+            measure(cur, backend, f"EXECUTE lookup({args})", params),
+        ]
+
+        cur.execute("DEALLOCATE lookup")
+
+        print(f"{name:<20} " + " ".join(f"{wall:>6.0f} /{cpu:>4.0f}"
+            for wall, cpu in results))
+
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# How many device-create requests for random, non-existing flock ids
+# still reach the database with the flock filter in front of it, and
+# what a lookup costs, for a growing number of existing flocks.
+#
+# The filter is loaded through FlockFilter.load() from a fake query
+# result, every existing flock is checked to never be rejected.
+#
+#   $ python3 src/api/bench/misses.py [filter size]
+#
+
+import sys
+import time
+import random
+import asyncio
+
+import korestub
+
+from flockfilter import FlockFilter
+
+FLOCKS = [10000, 100000, 250000, 500000]
+LOOKUPS = 200000
+
+def token():
+    return f"{random.getrandbits(64):016x}"
+
+def run(size, flocks):
+    tokens = set(token() for _ in range(flocks))
+
+    async def query(db, sql, params=None):
+        return [{"network_token": t} for t in tokens]
+
+    korestub.dbquery = query
+
+    flock_filter = FlockFilter(size)
+    asyncio.run(flock_filter.load())
+
+    for t in tokens:
+        if not flock_filter.maybe(t):
+            raise RuntimeError(f"existing flock {t} rejected")
+
+    probes = [token() for _ in range(LOOKUPS)]
+    probes = [t for t in probes if t not in tokens]
+
+    start = time.perf_counter()
+    hits = sum(1 for t in probes if flock_filter.maybe(t))
+    elapsed = time.perf_counter() - start
+
+    return hits / len(probes), elapsed / len(probes) * 1e6
+
+def main():
+    size = 1048576
+
+    if len(sys.argv) == 2:
+        size = int(sys.argv[1])
+
+    print(f"filter of {size} counters, {LOOKUPS} random ids per run")
+    print(f"{'flocks':>8} {'to database':>12} {'lookup':>10}")
+
+    for flocks in FLOCKS:
+        rate, cost = run(size, flocks)
+        print(f"{flocks:>8} {rate * 100:>11.3f}% {cost:>7.2f} us")
+
+if __name__ == "__main__":
+    main()
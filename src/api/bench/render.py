@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Render latency of the account templates, from get_template() to the
+# last byte of the streamed page, for:
+#
+#   cold      the first request on a worker when templates were only
+#             compiled on first use
+#   reload    every later request with auto_reload on, which stats
+#             the template file each time
+#   compiled  every request after templates_load(), outside of dev
+#
+#   $ python3 src/api/bench/render.py
+#
+
+import time
+import timeit
+import jinja2
+
+import korestub
+
+from api import TEMPLATES, TEMPLATES_PATH
+
+ITERATIONS = 2000
+
+CONTEXTS = {
+    "login.html": {},
+    "account.html": {
+        "id": 1,
+        "flocks": [{"id": f"{idx:016x}"} for idx in range(3)],
+        "account": "00" * 32,
+        "flocks_cur": 3,
+        "flocks_max": 3,
+        "expires": 86400,
+    },
+    "flock.html": {
+        "id": "1",
+        "flock": "0123456789abcdef",
+        "xflocks": [{"other": f"{idx:016x}", "network_owner": "1"}
+            for idx in range(4)],
+        "devices": [{
+            "kek_id": f"{idx + 1:02x}",
+            "device_cathedral_id": f"{idx:08x}",
+            "device_approved": "t" if idx % 2 else "f",
+            "created": "2026-01-01 00:00:00",
+        } for idx in range(50)],
+    },
+}
+
+def environment(reload):
+    return jinja2.Environment(
+        loader=jinja2.FileSystemLoader(TEMPLATES_PATH),
+        auto_reload=reload
+    )
+
+def render(env, name):
+    tmpl = env.get_template(name)
+    return "".join(tmpl.stream(CONTEXTS[name]))
+
+def cold(name):
+    start = time.perf_counter()
+    render(environment(True), name)
+    return time.perf_counter() - start
+
+def steady(env, name):
+    render(env, name)
+    return timeit.timeit(lambda: render(env, name), number=ITERATIONS) / \
+        ITERATIONS
+
+def main():
+    reload = environment(True)
+    compiled = environment(False)
+
+    for name in TEMPLATES:
+        compiled.get_template(name)
+
+    print(f"{'template':<14} {'cold':>10} {'reload':>10} {'compiled':>10}")
+
+    for name in TEMPLATES:
+        print(f"{name:<14} {cold(name) * 1e6:>7.0f} us "
+            f"{steady(reload, name) * 1e6:>7.0f} us "
+            f"{steady(compiled, name) * 1e6:>7.0f} us")
+
+if __name__ == "__main__":
+    main()
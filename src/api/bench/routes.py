@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Route classification cost per request, the path checks the three
+# prerequest hooks used to do each on their own against a single
+# RouteClassifier.classify() whose result the hooks share.
+#
+#   $ python3 src/api/bench/routes.py
+#
+
+import re
+import timeit
+
+import korestub
+
+from api import RouteClassifier, ACCOUNT_URLS, UNAUTHED_URLS
+
+PATHS = [
+    "/v1/flock/list",
+    "/v1/flock/0123456789abcdef/ambry",
+    "/v1/device/0123456789abcdef/create",
+    "/v1/register",
+    "/account/",
+    "/account/flock/0123456789abcdef",
+    "/account/xflock/0123456789abcdef/fedcba9876543210/delete",
+    "/account/login",
+]
+
+ITERATIONS = 100000
+
+#
+# The checks done by the ratelimit, token_fetch and token_verify hooks
+# before the classifier, for an authenticated request.
+#
+def hooks_before(path):
+    match = re.findall("^/account/[x]?flock/.*$", path)
+    if path in ACCOUNT_URLS or match:
+        web = True
+
+    if path == "/account/login":
+        return
+
+    match = re.findall("^/v1/device/([a-f0-9]{16})/create$", path)
+    if path in UNAUTHED_URLS or match:
+        return
+
+    match = re.findall("^/account/[x]?flock/.*$", path)
+    web = path in ACCOUNT_URLS or len(match) > 0
+
+    if path == "/account/login":
+        return
+
+    match = re.findall("^/v1/device/([a-f0-9]{16})/create$", path)
+    if path in UNAUTHED_URLS or match:
+        return
+
+def hooks_after(routes, path):
+    route = routes.classify(path)
+
+    if route.web:
+        web = True
+
+    if not route.authed:
+        return
+
+    web = route.web
+
+    if not route.authed:
+        return
+
+def main():
+    routes = RouteClassifier()
+
+    print(f"{'path':<60} {'before':>10} {'after':>10}")
+
+    for path in PATHS:
+        before = timeit.timeit(lambda: hooks_before(path), number=ITERATIONS)
+        after = timeit.timeit(lambda: hooks_after(routes, path),
+            number=ITERATIONS)
+
+        before = before / ITERATIONS * 1e9
+        after = after / ITERATIONS * 1e9
+        print(f"{path:<60} {before:>7.0f} ns {after:>7.0f} ns")
+
+if __name__ == "__main__":
+    main()
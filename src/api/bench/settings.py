@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Time and peak memory of Sync.publish() writing both settings files
+# for a growing number of allow lines, which should both grow linearly.
+# The files are written to a temporary directory.
+#
+#   $ python3 src/api/bench/settings.py
+#
+
+import time
+import tempfile
+import tracemalloc
+
+import korestub
+
+from sync import Sync
+
+DEVICES = 100
+LINES = [250000, 500000, 1000000]
+
+def setup(path, lines):
+    sync = Sync()
+    sync.counter = 0
+    sync.staged = {}
+    sync.flocks = {}
+    sync.xflocks = {}
+    sync.written = {}
+    sync.federate = {
+        "federate": ["federate 10.0.0.1 4500"],
+        "shrouded": ["federate 10.0.0.2 4500"],
+    }
+    sync.settings_path_old = f"{path}/settings.conf"
+    sync.settings_path = f"{path}/settings-shroud.conf"
+
+    for flock in range(lines // DEVICES):
+        devices = []
+
+        for device in range(DEVICES):
+            devices.append({
+                "kek": f"{device + 1}",
+                "pubkey": "NO-KEY",
+                "bw_limit": "25",
+                "cid": f"{flock * DEVICES + device:08x}",
+                "key": "00" * 32,
+            })
+
+        sync.flock_sync(f"{flock:016x}", devices)
+
+    sync.staged = {}
+
+    return sync
+
+def main():
+    print(f"{'allow lines':>12} {'publish':>10} {'peak':>10}")
+
+    for lines in LINES:
+        with tempfile.TemporaryDirectory() as path:
+            sync = setup(path, lines)
+
+            start = time.perf_counter()
+            sync.publish()
+            elapsed = time.perf_counter() - start
+
+            sync.written = {}
+            tracemalloc.start()
+            sync.publish()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print(f"{lines:>12} {elapsed:>8.2f} s {peak / 1e6:>7.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# How long the event loop of a worker stalls while an ambry is written
+# to a slow filesystem, writing on the loop itself against handing the
+# writes to fileio.FileIO the way ambry_store() does.
+#
+# The slow filesystem is simulated by sleeping before every write. A
+# ticker task, standing in for the other requests on the worker, wakes
+# up every millisecond and records the longest gap it saw.
+#
+#   $ python3 src/api/bench/slowfs.py [write delay in ms]
+#
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+import korestub
+
+from fileio import FileIO, pwrite
+
+CHUNK = 65536
+CHUNKS = 32
+
+def slow_pwrite(delay, fd, data, offset):
+    time.sleep(delay)
+    pwrite(fd, data, offset)
+
+async def ticker(state):
+    last = time.monotonic()
+
+    while state["running"]:
+        await asyncio.sleep(0.001)
+        now = time.monotonic()
+        state["stall"] = max(state["stall"], now - last)
+        last = now
+
+async def upload_inline(fileio, delay, fd, chunk):
+    for idx in range(CHUNKS):
+        slow_pwrite(delay, fd, chunk, idx * CHUNK)
+        await asyncio.sleep(0)
+
+async def upload_pool(fileio, delay, fd, chunk):
+    pending = None
+
+    for idx in range(CHUNKS):
+        if pending is not None:
+            await fileio.wait(pending)
+        pending = fileio.submit(slow_pwrite, delay, fd, chunk, idx * CHUNK)
+
+    await fileio.wait(pending)
+
+async def run(upload, delay):
+    fileio = FileIO(2)
+    state = {"running": True, "stall": 0}
+    chunk = os.urandom(CHUNK)
+
+    with tempfile.TemporaryFile() as f:
+        task = asyncio.create_task(ticker(state))
+        await asyncio.sleep(0.01)
+
+        start = time.monotonic()
+        await upload(fileio, delay, f.fileno(), chunk)
+        elapsed = time.monotonic() - start
+
+        state["running"] = False
+        await task
+
+    return elapsed, state["stall"]
+
+def main():
+    delay = 0.02
+
+    if len(sys.argv) == 2:
+        delay = int(sys.argv[1]) / 1000
+
+    print(f"{CHUNKS} chunks of {CHUNK} bytes, {delay * 1000:.0f} ms per write")
+
+    for name, upload in (("inline", upload_inline), ("fileio", upload_pool)):
+        elapsed, stall = asyncio.run(run(upload, delay))
+        print(f"{name:<8} upload {elapsed * 1000:>6.0f} ms, "
+            f"longest loop stall {stall * 1000:>6.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Shared rate limiting across forked workers. The limiter is created
+# before forking, like Api.configure() does, after which every worker
+# hammers the same clients for a few seconds.
+#
+# For each worker count it reports the combined checks per second and
+# how many requests got through against what the budget allows, which
+# must not grow with the number of workers.
+#
+#   $ python3 src/api/bench/workers.py [seconds]
+#
+
+import sys
+import time
+import multiprocessing
+
+import korestub
+
+from ratelimit import RateLimit, RATELIMIT_BUDGETS
+
+CLIENTS = 256
+SETS = 65536
+WORKERS = [1, 2, 4, 8]
+
+def worker(limiter, seconds, results):
+    checks = 0
+    admitted = 0
+    end = time.monotonic() + seconds
+
+    while time.monotonic() < end:
+        for idx in range(CLIENTS):
+            if limiter.check(f"10.0.0.{idx}", "default"):
+                admitted += 1
+            checks += 1
+
+    results.put((checks, admitted))
+
+def run(count, seconds):
+    ctx = multiprocessing.get_context("fork")
+    limiter = RateLimit(None, SETS)
+    results = ctx.Queue()
+
+    procs = [ctx.Process(target=worker, args=(limiter, seconds, results))
+        for _ in range(count)]
+
+    for proc in procs:
+        proc.start()
+
+    checks = 0
+    admitted = 0
+
+    for _ in procs:
+        done, ok = results.get()
+        checks += done
+        admitted += ok
+
+    for proc in procs:
+        proc.join()
+
+    return checks / seconds, admitted
+
+def main():
+    seconds = 3
+
+    if len(sys.argv) == 2:
+        seconds = int(sys.argv[1])
+
+    rate, burst = RATELIMIT_BUDGETS["default"]
+    allowed = int(CLIENTS * (burst + rate * seconds))
+
+    print(f"{CLIENTS} clients for {seconds}s, budget allows {allowed}")
+
+    for count in WORKERS:
+        rps, admitted = run(count, seconds)
+        print(f"{count} workers: {rps:>10.0f} checks/s, {admitted} admitted")
+
+if __name__ == "__main__":
+    main()
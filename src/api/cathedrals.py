@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import kore
+import hashlib
+
+from queries import SQL_CATHEDRALS_VERSION, SQL_GET_CATHEDRALS
+
+#
+# The rendered cathedral list, kept in memory by every worker.
+#
+# The cathedrals table hardly ever changes, a trigger bumps its counter
+# in table_versions when it does. Each worker compares that counter
+# every interval seconds and only then renders the list again, so
+# requests are answered from memory.
+#
+class CathedralCache:
+    def __init__(self, db, interval):
+        self.db = db
+        self.body = None
+        self.etag = None
+        self.version = None
+        self.interval = interval
+        kore.task_create(self.poll())
+
+    async def get(self):
+        if self.body is None:
+            await self.refresh()
+
+        return self.body, self.etag
+
+    async def poll(self):
+        while True:
+            await kore.suspend(self.interval * 1000)
+
+            try:
+                await self.refresh()
+            except Exception as e:
+                kore.log(kore.LOG_NOTICE, f"cathedral refresh failed: {e}")
+
+    async def refresh(self):
+        res = await self.db.query(SQL_CATHEDRALS_VERSION)
+        version = res[0]["table_version"] if len(res) == 1 else None
+
+        if version is not None and version == self.version:
+            return
+
+        cathedrals = await self.db.query(SQL_GET_CATHEDRALS)
+
+        lines = []
+        for cathedral in cathedrals:
+            ip = cathedral["cathedral_ip"]
+            port = cathedral["cathedral_port"]
+            descr = cathedral["cathedral_descr"]
+
+            if descr != "":
+                lines.append(f"{descr} - {ip}:{port}\n")
+            else:
+                lines.append(f"{ip}:{port}\n")
+
+        body = "".join(lines).encode()
+
+        self.body = body
+        self.etag = f'"{hashlib.sha256(body).hexdigest()}"'
+        self.version = version
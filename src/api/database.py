@@ -0,0 +1,101 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import kore
+
+from queries import *
+
+#
+# Read-only statements that may be answered by the replica. Everything
+# else, and anything a caller needs to see its own writes for, goes to
+# the primary.
+#
+REPLICA_QUERIES = set([
+    SQL_GET_CATHEDRALS,
+    SQL_CATHEDRALS_VERSION,
+    SQL_NETWORK_LIST,
+    SQL_DEVICE_LIST,
+    SQL_XFLOCK_LIST,
+])
+
+#
+# Replay lag of the replica in seconds. A replica that replayed all it
+# received is current even if the primary has not written in a while,
+# but only while its WAL receiver is streaming, otherwise it has no
+# idea what it is missing and the lag is NULL. So is the lag of one
+# that is behind without having replayed a transaction since it was
+# started, there is no replay timestamp to measure it against.
+#
+SQL_REPLICA_LAG = """
+SELECT
+    CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END AS lag
+"""
+
+#
+# Routes queries between the primary ("db") and an optional streaming
+# replica ("replica") configured through DBHOST_REPLICA.
+#
+# The replica is only used while its lag, checked every interval
+# seconds, stays within maxlag seconds. A failing replica query marks
+# it unhealthy until the next successful check and is retried on the
+# primary.
+#
+class Database:
+    def __init__(self, host, replica, interval, maxlag):
+        self.healthy = False
+        self.maxlag = maxlag
+        self.replica = replica
+        self.interval = interval
+
+        kore.dbsetup("db", f"host={host} dbname=accounts")
+
+        if self.replica is not None:
+            kore.dbsetup("replica", f"host={replica} dbname=accounts")
+            kore.task_create(self.monitor())
+
+    async def query(self, sql, params=None, primary=False):
+        if primary or not self.healthy or sql not in REPLICA_QUERIES:
+            return await kore.dbquery("db", sql, params=params)
+
+        try:
+            return await kore.dbquery("replica", sql, params=params)
+        except Exception as e:
+            kore.log(kore.LOG_NOTICE, f"replica query failed: {e}")
+            self.healthy = False
+
+        return await kore.dbquery("db", sql, params=params)
+
+    async def monitor(self):
+        while True:
+            try:
+                res = await kore.dbquery("replica", SQL_REPLICA_LAG)
+                lag = res[0]["lag"]
+                healthy = lag is not None and float(lag) <= self.maxlag
+            except Exception as e:
+                kore.log(kore.LOG_NOTICE, f"replica check failed: {e}")
+                healthy = False
+
+            if healthy != self.healthy:
+                state = "using" if healthy else "bypassing"
+                kore.log(kore.LOG_INFO, f"{state} replica {self.replica}")
+                self.healthy = healthy
+
+            await kore.suspend(self.interval * 1000)
@@ -0,0 +1,88 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import kore
+import concurrent.futures
+
+FILEIO_POLL = 2
+
+#
+# Runs blocking filesystem work on a small pool of threads so a slow
+# disk does not stall the Kore event loop of the worker.
+#
+# Kore cannot be woken up from another thread, so a coroutine waiting
+# on the pool polls its future every FILEIO_POLL milliseconds. Jobs
+# should therefore be coarse, a whole file rather than a single write.
+#
+# The pool is created on first use so that each worker starts its own
+# threads after the fork instead of inheriting none from the parent.
+#
+# Not everything can go through the pool: reading a request body that
+# Kore spooled to disk is done by Kore itself through req.body_read()
+# and stays on the event loop.
+#
+class FileIO:
+    def __init__(self, threads):
+        self.pool = None
+        self.threads = threads
+
+    def submit(self, func, *args):
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.threads,
+                thread_name_prefix="fileio"
+            )
+
+        return self.pool.submit(func, *args)
+
+    async def settle(self, future):
+        while not future.done():
+            await kore.suspend(FILEIO_POLL)
+
+    async def wait(self, future):
+        await self.settle(future)
+        return future.result()
+
+    async def run(self, func, *args):
+        return await self.wait(self.submit(func, *args))
+
+#
+# Write all of data at the given offset, os.pwrite() may be short.
+#
+def pwrite(fd, data, offset):
+    view = memoryview(data)
+
+    while len(view) > 0:
+        written = os.pwrite(fd, view, offset)
+        view = view[written:]
+        offset += written
+
+#
+# The system calls the pool threads need on top of what the
+# application itself already allowed.
+#
+FILEIO_SYSCALLS = [
+    "clone",
+    "clone3",
+    "futex",
+    "madvise",
+    "mprotect",
+    "rseq",
+    "set_robust_list",
+    "exit",
+    "pread64",
+    "pwrite64",
+]
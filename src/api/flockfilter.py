@@ -0,0 +1,112 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import kore
+import mmap
+import hashlib
+import multiprocessing
+
+from queries import SQL_NETWORK_TOKENS
+
+FILTER_HASHES = 4
+FILTER_HEADER = 8
+FILTER_SATURATED = 255
+
+FILTER_EMPTY = 0
+FILTER_LOADING = 1
+FILTER_READY = 2
+
+#
+# A counting Bloom filter of every existing flock token, used to answer
+# lookups for flocks that certainly do not exist without asking the
+# database.
+#
+# Like the rate limiter it lives in an anonymous shared mapping created
+# before the workers fork. The first byte holds its state, the rest are
+# 8-bit counters. A counter that reached FILTER_SATURATED is never
+# decremented again, that and flocks removed by cascading deletes only
+# cause false positives, which end up at the database as before.
+#
+# Until the filter is READY every token is a possible member. load()
+# clears it before reading the tokens from the database, so a flock
+# created while loading is either in the result or added afterwards.
+#
+# The size wants to be about ten counters per flock, that keeps the
+# share of unknown flocks still sent to the database around 1%. At a
+# quarter of that it is already 14% (see bench/misses.py).
+#
+class FlockFilter:
+    def __init__(self, size):
+        self.size = size
+        self.lock = multiprocessing.Lock()
+        self.map = mmap.mmap(-1, FILTER_HEADER + size)
+
+    def indices(self, token):
+        digest = hashlib.blake2b(token.encode(), digest_size=FILTER_HASHES * 4)
+        data = digest.digest()
+
+        for idx in range(FILTER_HASHES):
+            value = int.from_bytes(data[idx * 4:(idx + 1) * 4], "little")
+            yield FILTER_HEADER + (value % self.size)
+
+    def ready(self):
+        return self.map[0] == FILTER_READY
+
+    def maybe(self, token):
+        if not self.ready():
+            return True
+
+        for idx in self.indices(token):
+            if self.map[idx] == 0:
+                return False
+
+        return True
+
+    def add(self, token):
+        with self.lock:
+            for idx in self.indices(token):
+                if self.map[idx] != FILTER_SATURATED:
+                    self.map[idx] += 1
+
+    def remove(self, token):
+        with self.lock:
+            if self.map[0] != FILTER_READY:
+                return
+
+            for idx in self.indices(token):
+                if self.map[idx] != FILTER_SATURATED and self.map[idx] != 0:
+                    self.map[idx] -= 1
+
+    async def load(self):
+        with self.lock:
+            self.map[0] = FILTER_LOADING
+            self.map[FILTER_HEADER:] = bytes(self.size)
+
+        try:
+            rows = await kore.dbquery("db", SQL_NETWORK_TOKENS)
+        except Exception:
+            with self.lock:
+                self.map[0] = FILTER_EMPTY
+            raise
+
+        with self.lock:
+            for row in rows:
+                for idx in self.indices(row["network_token"]):
+                    if self.map[idx] != FILTER_SATURATED:
+                        self.map[idx] += 1
+
+            self.map[0] = FILTER_READY
+
+        return len(rows)
@@ -0,0 +1,50 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import os
+import kore
+import fcntl
+
+#
+# Elects a single worker to run the periodic background tasks.
+#
+# The worker that grabs an exclusive flock() on the given path is the
+# leader until it exits, at which point the kernel drops the lock and
+# the next worker asking for it takes over.
+#
+# The lock file is opened lazily so that every worker has its own open
+# file description instead of sharing the one from the parent.
+#
+class Leader:
+    def __init__(self, path):
+        self.fd = -1
+        self.path = path
+
+    def elected(self):
+        if self.fd != -1:
+            return True
+
+        fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+
+        self.fd = fd
+        kore.log(kore.LOG_INFO, "elected to run background tasks")
+
+        return True
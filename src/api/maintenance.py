@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import kore
+import time
+import random
+
+MAINTENANCE_JITTER = 0.1
+MAINTENANCE_PASSES = 100
+
+class MaintenanceJob:
+    def __init__(self, name, interval, func, immediate, backlog):
+        self.due = 0
+        self.name = name
+        self.func = func
+        self.backlog = backlog
+        self.interval = interval
+
+        if not immediate:
+            self.schedule()
+
+    def schedule(self):
+        jitter = random.uniform(-MAINTENANCE_JITTER, MAINTENANCE_JITTER)
+        self.due = time.monotonic() + self.interval * (1 + jitter)
+
+#
+# Runs the background cleanup jobs on the elected leader only.
+#
+# Every job is called with the batch size and handles at most that many
+# rows per pass, returning how many rows it removed and whether there
+# may be more left. Passes are repeated, with a short pause in between
+# so that the worker keeps serving requests, until nothing is left or
+# the job ran MAINTENANCE_PASSES passes, the rest is picked up on its
+# next run.
+#
+# A job can also pass a backlog function, called with a limit after its
+# passes to count how much is still waiting, up to that limit, so the
+# log shows whether a job keeps up.
+#
+# Intervals are jittered so jobs do not line up with each other.
+#
+class Maintenance:
+    def __init__(self, leader, batch, pause):
+        self.jobs = []
+        self.batch = batch
+        self.pause = pause
+        self.leader = leader
+        kore.task_create(self.run())
+
+    def job(self, name, interval, func, immediate=False, backlog=None):
+        self.jobs.append(
+            MaintenanceJob(name, interval, func, immediate, backlog)
+        )
+
+    async def run(self):
+        while True:
+            if len(self.jobs) == 0:
+                await kore.suspend(1000)
+                continue
+
+            now = time.monotonic()
+            job = min(self.jobs, key=lambda job: job.due)
+
+            if job.due > now:
+                await kore.suspend(int((job.due - now) * 1000) + 1)
+                continue
+
+            job.schedule()
+
+            if self.leader.elected():
+                await self.execute(job)
+
+    async def execute(self, job):
+        rows = 0
+        passes = 0
+        more = False
+        start = time.monotonic()
+
+        try:
+            while passes < MAINTENANCE_PASSES:
+                done, more = await job.func(self.batch)
+                rows += done
+                passes += 1
+
+                if not more:
+                    break
+
+                await kore.suspend(self.pause)
+        except Exception as e:
+            kore.log(kore.LOG_NOTICE, f"maintenance {job.name} failed: {e}")
+            return
+
+        if rows == 0:
+            return
+
+        msec = int((time.monotonic() - start) * 1000)
+        state = "more left" if more else "done"
+
+        if job.backlog is not None:
+            limit = self.batch * MAINTENANCE_PASSES
+
+            try:
+                left = await job.backlog(limit)
+                capped = "+" if left >= limit else ""
+                state = f"{state}, backlog {left}{capped}"
+            except Exception as e:
+                kore.log(kore.LOG_NOTICE,
+                    f"maintenance {job.name} backlog failed: {e}")
+
+        kore.log(kore.LOG_INFO,
+            f"maintenance {job.name}: {rows} rows in {passes} passes, "
+            f"{msec} ms, {state}"
+        )
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Applies the numbered migrations in the given directory on top of an
+# accounts database that was created from schema.sql.
+#
+# Each migration is a file named NNNN-description.sql, runs in its own
+# transaction and is recorded in schema_migrations so it is applied
+# exactly once. Migrations themselves are written to be idempotent so
+# they can safely be applied to a live database in place.
+#
+# A migration starting with MIGRATION_NO_TRANSACTION runs outside of a
+# transaction instead, one statement at a time, so it can use things
+# like CREATE INDEX CONCURRENTLY. Its statements must each end with a
+# semicolon at the end of a line and should be safe to run again, as
+# it is only recorded once all of them succeeded.
+#
+
+import os
+import re
+import sys
+import psycopg2
+
+MIGRATION_LOCK = 0x726c71
+MIGRATION_NO_TRANSACTION = "-- migrate: no-transaction"
+
+SQL_SCHEMA_LOADED = """
+SELECT to_regclass('accounts') IS NOT NULL AS loaded
+"""
+
+SQL_MIGRATIONS_CREATE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    migration_version int primary key,
+    migration_name varchar(128) not null,
+    migration_applied int not null default EXTRACT(EPOCH FROM NOW())
+)
+"""
+
+SQL_MIGRATIONS_APPLIED = """
+SELECT
+    migration_version
+FROM
+    schema_migrations
+"""
+
+SQL_MIGRATION_RECORD = """
+INSERT INTO schema_migrations
+    (migration_version, migration_name)
+VALUES
+    (%s, %s)
+"""
+
+def migrations(path):
+    result = []
+
+    for name in sorted(os.listdir(path)):
+        match = re.match("^([0-9]{4})-[a-z0-9-]+\\.sql$", name)
+        if match:
+            result.append((int(match.group(1)), name))
+
+    return result
+
+def statements(sql):
+    result = []
+    current = []
+
+    for line in sql.splitlines():
+        if line.strip().startswith("--"):
+            continue
+
+        current.append(line)
+
+        if line.rstrip().endswith(";"):
+            result.append("\n".join(current).strip())
+            current = []
+
+    if "\n".join(current).strip() != "":
+        result.append("\n".join(current).strip())
+
+    return result
+
+def apply(conn, cur, version, name, sql):
+    if not sql.startswith(MIGRATION_NO_TRANSACTION):
+        cur.execute(sql)
+        cur.execute(SQL_MIGRATION_RECORD, [version, name])
+        conn.commit()
+        return
+
+    conn.autocommit = True
+
+    try:
+        for statement in statements(sql):
+            cur.execute(statement)
+        cur.execute(SQL_MIGRATION_RECORD, [version, name])
+    finally:
+        conn.autocommit = False
+
+def main():
+    if len(sys.argv) != 2:
+        print("Usage: migrate.py [migrations directory]")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    dbhost = os.getenv("DBHOST", default="/var/run/postgresql")
+
+    conn = psycopg2.connect(f"host={dbhost} dbname=accounts")
+    cur = conn.cursor()
+
+    cur.execute(SQL_SCHEMA_LOADED)
+    if cur.fetchone()[0] is False:
+        print("no accounts schema loaded, skipping migrations")
+        conn.rollback()
+        return
+
+    cur.execute("SELECT pg_advisory_lock(%s)", [MIGRATION_LOCK])
+    cur.execute(SQL_MIGRATIONS_CREATE)
+    conn.commit()
+
+    cur.execute(SQL_MIGRATIONS_APPLIED)
+    applied = set(row[0] for row in cur.fetchall())
+    conn.commit()
+
+    for version, name in migrations(path):
+        if version in applied:
+            continue
+
+        with open(f"{path}/{name}", "r") as f:
+            sql = f.read()
+
+        try:
+            apply(conn, cur, version, name, sql)
+        except Exception as e:
+            conn.rollback()
+            print(f"migration {name} failed: {e}")
+            sys.exit(1)
+
+        print(f"applied {name}")
+
+    cur.execute("SELECT pg_advisory_unlock(%s)", [MIGRATION_LOCK])
+    conn.commit()
+    conn.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+-- migrate: no-transaction
+--
+-- Indexes for the lookups done on every request and every sync cycle.
+--
+-- They are built concurrently so that applying this migration to a live
+-- database does not block writes to these tables. A build that failed
+-- leaves an INVALID index behind that IF NOT EXISTS will skip, drop it
+-- before running the migrations again.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tokens_value_idx
+    ON tokens (token_value);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tokens_expires_idx
+    ON tokens (token_expires);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS accounts_key_idx
+    ON accounts (account_key);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS networks_owner_idx
+    ON networks (network_owner);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS devices_network_token_idx
+    ON devices (device_network_token);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS devices_cathedral_id_idx
+    ON devices (device_cathedral_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS devices_network_idx
+    ON devices (device_network);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS xflocks_binding_idx
+    ON xflocks (xflock_src_token, xflock_dst_token, xflock_owner);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS xflocks_src_dst_idx
+    ON xflocks (xflock_src, xflock_dst);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS xflocks_owner_idx
+    ON xflocks (xflock_owner);
@@ -0,0 +1,89 @@
+-- Change log consumed by sync so a cycle only touches flocks that
+-- actually changed. Every write that can alter a flock stanza or an
+-- xflock binding records the affected flock token here.
+
+CREATE TABLE IF NOT EXISTS flock_changes (
+    change_id bigserial primary key,
+    change_kind varchar(8) not null default 'flock',
+    change_token varchar(64) not null
+);
+
+CREATE INDEX IF NOT EXISTS accounts_time_left_idx
+    ON accounts (account_time_left);
+
+CREATE OR REPLACE FUNCTION flock_changes_devices() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        INSERT INTO flock_changes (change_token)
+            VALUES (OLD.device_network_token);
+    END IF;
+
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO flock_changes (change_token)
+            VALUES (NEW.device_network_token);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION flock_changes_networks() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO flock_changes (change_token) VALUES (OLD.network_token);
+    ELSIF TG_OP = 'INSERT' OR
+        OLD.network_ambry_update IS DISTINCT FROM NEW.network_ambry_update THEN
+        INSERT INTO flock_changes (change_token) VALUES (NEW.network_token);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION flock_changes_accounts() RETURNS trigger AS $$
+BEGIN
+    IF OLD.account_time_left IS DISTINCT FROM NEW.account_time_left THEN
+        INSERT INTO flock_changes (change_token)
+            SELECT network_token FROM networks
+            WHERE network_owner = NEW.account_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION flock_changes_xflocks() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO flock_changes (change_kind, change_token)
+            VALUES ('xflock', OLD.xflock_src_token),
+                   ('xflock', OLD.xflock_dst_token);
+    ELSE
+        INSERT INTO flock_changes (change_kind, change_token)
+            VALUES ('xflock', NEW.xflock_src_token),
+                   ('xflock', NEW.xflock_dst_token);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS devices_changed ON devices;
+CREATE TRIGGER devices_changed
+    AFTER INSERT OR UPDATE OR DELETE ON devices
+    FOR EACH ROW EXECUTE FUNCTION flock_changes_devices();
+
+DROP TRIGGER IF EXISTS networks_changed ON networks;
+CREATE TRIGGER networks_changed
+    AFTER INSERT OR UPDATE OR DELETE ON networks
+    FOR EACH ROW EXECUTE FUNCTION flock_changes_networks();
+
+DROP TRIGGER IF EXISTS accounts_changed ON accounts;
+CREATE TRIGGER accounts_changed
+    AFTER UPDATE ON accounts
+    FOR EACH ROW EXECUTE FUNCTION flock_changes_accounts();
+
+DROP TRIGGER IF EXISTS xflocks_changed ON xflocks;
+CREATE TRIGGER xflocks_changed
+    AFTER INSERT OR UPDATE OR DELETE ON xflocks
+    FOR EACH ROW EXECUTE FUNCTION flock_changes_xflocks();
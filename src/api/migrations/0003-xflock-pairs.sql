@@ -0,0 +1,65 @@
+-- Established cross-flock pairs, kept current by a trigger on xflocks.
+-- A pair exists when both flocks have bound to each other and is
+-- stored once in canonical order (pair_a < pair_b).
+
+CREATE TABLE IF NOT EXISTS xflock_pairs (
+    pair_a varchar(64) not null,
+    pair_b varchar(64) not null,
+    primary key (pair_a, pair_b)
+);
+
+CREATE INDEX IF NOT EXISTS xflock_pairs_b_idx ON xflock_pairs (pair_b);
+
+CREATE OR REPLACE FUNCTION xflock_pairs_update() RETURNS trigger AS $$
+DECLARE
+    src int;
+    dst int;
+    flock_a varchar(64);
+    flock_b varchar(64);
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        src := OLD.xflock_src;
+        dst := OLD.xflock_dst;
+        flock_a := LEAST(OLD.xflock_src_token, OLD.xflock_dst_token);
+        flock_b := GREATEST(OLD.xflock_src_token, OLD.xflock_dst_token);
+    ELSE
+        src := NEW.xflock_src;
+        dst := NEW.xflock_dst;
+        flock_a := LEAST(NEW.xflock_src_token, NEW.xflock_dst_token);
+        flock_b := GREATEST(NEW.xflock_src_token, NEW.xflock_dst_token);
+    END IF;
+
+    -- Serialize both directions of the same pair so two bindings
+    -- created at the same time still see each other.
+    PERFORM pg_advisory_xact_lock(hashtext(flock_a || flock_b));
+
+    IF EXISTS (SELECT 1 FROM xflocks
+        WHERE xflock_src = src AND xflock_dst = dst) AND
+       EXISTS (SELECT 1 FROM xflocks
+        WHERE xflock_src = dst AND xflock_dst = src) THEN
+        INSERT INTO xflock_pairs (pair_a, pair_b)
+            VALUES (flock_a, flock_b) ON CONFLICT DO NOTHING;
+    ELSE
+        DELETE FROM xflock_pairs
+            WHERE pair_a = flock_a AND pair_b = flock_b;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS xflocks_pairs ON xflocks;
+CREATE TRIGGER xflocks_pairs
+    AFTER INSERT OR DELETE ON xflocks
+    FOR EACH ROW EXECUTE FUNCTION xflock_pairs_update();
+
+INSERT INTO xflock_pairs (pair_a, pair_b)
+    SELECT DISTINCT
+        LEAST(a.xflock_src_token, a.xflock_dst_token),
+        GREATEST(a.xflock_src_token, a.xflock_dst_token)
+    FROM
+        xflocks a
+    JOIN
+        xflocks b ON b.xflock_src = a.xflock_dst AND
+        b.xflock_dst = a.xflock_src
+ON CONFLICT DO NOTHING;
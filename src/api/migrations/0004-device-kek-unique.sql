@@ -0,0 +1,9 @@
+-- KEKs are handed out per flock, an approved device owns its KEK slot.
+-- Unapproved devices all carry KEK 0 and are left out of the index.
+--
+-- Creating the index fails if concurrent approvals in the past already
+-- handed the same KEK to two devices, those have to be resolved first.
+
+CREATE UNIQUE INDEX IF NOT EXISTS devices_network_kek_idx
+    ON devices (device_network_token, device_kek)
+    WHERE device_approved;
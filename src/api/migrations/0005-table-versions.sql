@@ -0,0 +1,26 @@
+-- Version counters for rarely changing tables that workers cache in
+-- memory. A statement level trigger bumps the counter on every change
+-- so a worker only has to compare a single number to know its copy is
+-- still current.
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    table_name varchar(64) primary key,
+    table_version bigint not null default 0
+);
+
+INSERT INTO table_versions (table_name)
+    VALUES ('cathedrals') ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION table_versions_bump() RETURNS trigger AS $$
+BEGIN
+    UPDATE table_versions SET table_version = table_version + 1
+        WHERE table_name = TG_TABLE_NAME;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS cathedrals_version ON cathedrals;
+CREATE TRIGGER cathedrals_version
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON cathedrals
+    FOR EACH STATEMENT EXECUTE FUNCTION table_versions_bump();
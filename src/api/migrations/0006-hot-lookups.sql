@@ -0,0 +1,45 @@
+-- The lookups done on (nearly) every API request, wrapped in PL/pgSQL.
+--
+-- Kore always sends the full query text, so there is no way to prepare
+-- a statement from the API itself. PL/pgSQL however prepares the
+-- statements it runs once per connection and keeps their plans, which
+-- leaves only a trivial function call to be parsed per request.
+
+CREATE OR REPLACE FUNCTION api_account_from_token(token varchar, web boolean)
+RETURNS TABLE (
+    account_id int,
+    account_time_left int,
+    account_key varchar,
+    account_flocks_max int,
+    token_expires int
+) AS $$
+BEGIN
+    RETURN QUERY
+        SELECT
+            a.account_id, a.account_time_left, a.account_key,
+            a.account_flocks_max, t.token_expires
+        FROM
+            tokens t
+        JOIN
+            accounts a ON a.account_id = t.token_account
+        WHERE
+            t.token_value = token AND t.token_web = web AND
+            t.token_expires > EXTRACT(epoch FROM now());
+END;
+$$ LANGUAGE plpgsql STABLE;
+
+CREATE OR REPLACE FUNCTION api_network_get(token varchar, owner int)
+RETURNS TABLE (
+    network_id int,
+    network_token varchar
+) AS $$
+BEGIN
+    RETURN QUERY
+        SELECT
+            n.network_id, n.network_token
+        FROM
+            networks n
+        WHERE
+            n.network_token = token AND n.network_owner = owner;
+END;
+$$ LANGUAGE plpgsql STABLE;
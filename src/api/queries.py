@@ -22,6 +22,15 @@ ORDER BY
     cathedral_ip
 """
 
+SQL_CATHEDRALS_VERSION = """
+SELECT
+    table_version
+FROM
+    table_versions
+WHERE
+    table_name = 'cathedrals'
+"""
+
 SQL_ACCOUNT_FROM_KEY = """
 SELECT
     account_id, account_time_left
@@ -31,28 +40,17 @@ WHERE
     account_key = $1
 """
 
+#
+# SQL_ACCOUNT_FROM_TOKEN and SQL_NETWORK_GET run for nearly every
+# request, they call functions from migrations/0006-hot-lookups.sql so
+# their plans stay cached per connection.
+#
 SQL_ACCOUNT_FROM_TOKEN = """
-WITH account_info AS (
-    SELECT
-        account_id, account_time_left, account_key, account_flocks_max
-    FROM
-        tokens
-    JOIN
-        accounts ON accounts.account_id = tokens.token_account
-    WHERE
-        token_value = $1 and token_web = $2
-)
-
-UPDATE
-    tokens
-SET
-    token_expires = (EXTRACT(epoch FROM now()) + 2592000)
+SELECT
+    account_id, account_time_left, account_key, account_flocks_max,
+    token_expires
 FROM
-    account_info
-WHERE
-    token_value = $1
-RETURNING
-    *
+    api_account_from_token($1, $2)
 """
 
 SQL_ACCOUNT_CREATE = """
@@ -87,6 +85,15 @@ VALUES
     ($1, $2, $3)
 """
 
+SQL_TOKEN_REFRESH = """
+UPDATE
+    tokens
+SET
+    token_expires = (EXTRACT(epoch FROM now()) + 2592000)
+WHERE
+    token_value = ANY(string_to_array($1, ','))
+"""
+
 SQL_NETWORK_CREATE = """
 INSERT INTO networks
     (network_token, network_owner)
@@ -106,18 +113,14 @@ SQL_NETWORK_GET = """
 SELECT
     network_id, network_token
 FROM
-    networks
-WHERE
-    network_token = $1 AND network_owner = $2
+    api_network_get($1, $2)
 """
 
-SQL_NETWORK_GET_OWNER = """
+SQL_NETWORK_TOKENS = """
 SELECT
-    network_id, network_owner
+    network_token
 FROM
     networks
-WHERE
-    network_token = $1
 """
 
 SQL_NETWORK_GET_UNAUTHED = """
@@ -149,20 +152,83 @@ WHERE
     network_token = $1 and network_owner = $2
 """
 
-SQL_XFLOCK_GET = """
+#
+# Binds flock $1, owned by $3, to flock $2 unless that binding already
+# exists, in one statement. Returns a single row, src or dst are NULL if
+# the caller does not own $1 or $2 does not exist, mutual tells if $2
+# is bound back to $1 so the xflock is established.
+#
+SQL_XFLOCK_CREATE = """
+WITH src AS (
+    SELECT
+        network_id
+    FROM
+        networks
+    WHERE
+        network_token = $1 AND network_owner = $3
+), dst AS (
+    SELECT
+        network_id
+    FROM
+        networks
+    WHERE
+        network_token = $2
+), created AS (
+    INSERT INTO xflocks
+        (xflock_src, xflock_src_token, xflock_dst, xflock_dst_token, xflock_owner)
+    SELECT
+        src.network_id, $1, dst.network_id, $2, $3
+    FROM
+        src, dst
+    WHERE NOT EXISTS (
+        SELECT
+            1
+        FROM
+            xflocks
+        WHERE
+            xflock_src = src.network_id AND
+            xflock_dst = dst.network_id AND
+            xflock_owner = $3
+    )
+    RETURNING
+        xflock_id
+)
 SELECT
-    xflock_id
-FROM
-    xflocks
-WHERE
-    xflock_src = $1 AND xflock_dst = $2 AND xflock_owner = $3
+    (SELECT network_id FROM src) AS src,
+    (SELECT network_id FROM dst) AS dst,
+    EXISTS (SELECT 1 FROM created) AS created,
+    EXISTS (
+        SELECT
+            1
+        FROM
+            xflocks
+        WHERE
+            xflock_src_token = $2 AND xflock_dst_token = $1
+    ) AS mutual
 """
 
-SQL_XFLOCK_CREATE = """
-INSERT INTO xflocks
-    (xflock_src, xflock_src_token, xflock_dst, xflock_dst_token, xflock_owner)
-VALUES
-    ($1, $2, $3, $4, $5)
+#
+# Whether account $3 owns flock $1 and the xflock between $1 and $2 is
+# established, always a single row.
+#
+SQL_XFLOCK_ACCESS = """
+SELECT
+    EXISTS (
+        SELECT
+            1
+        FROM
+            networks
+        WHERE
+            network_token = $1 AND network_owner = $3
+    ) AS owned,
+    EXISTS (
+        SELECT
+            1
+        FROM
+            xflock_pairs
+        WHERE
+            pair_a = LEAST($1, $2) AND pair_b = GREATEST($1, $2)
+    ) AS mutual
 """
 
 SQL_XFLOCK_LIST = """
@@ -229,17 +295,163 @@ WHERE
 IS TRUE RETURNING device_id
 """
 
+#
+# Picks the lowest free KEK slot of the flock and claims it for the
+# device of account $3 in the same statement. The free column is NULL
+# when the flock ran out of KEKs, kek is NULL when the device does not
+# exist or was already approved.
+#
+# Two approvals racing for the same slot are caught by the unique
+# devices_network_kek_idx index, the loser simply tries again.
+#
 SQL_DEVICE_APPROVE = """
-UPDATE
-    devices
-SET
-    device_approved = 't', device_kek = $3
-WHERE
-    device_network_token = $1 AND
-    device_cathedral_id = $2 AND
-    device_approved = 'f'
+WITH slot AS (
+    SELECT
+        kek
+    FROM
+        generate_series(1, 255) AS kek
+    WHERE
+        kek NOT IN (
+            SELECT
+                device_kek
+            FROM
+                devices
+            WHERE
+                device_network_token = $1 AND
+                device_approved = 't'
+        )
+    ORDER BY
+        kek
+    LIMIT 1
+), approved AS (
+    UPDATE
+        devices
+    SET
+        device_approved = 't', device_kek = slot.kek
+    FROM
+        slot
+    WHERE
+        device_network_token = $1 AND
+        device_cathedral_id = $2 AND
+        device_account = $3 AND
+        device_approved = 'f'
+    RETURNING
+        device_kek
+)
+SELECT
+    (SELECT kek FROM slot) AS free,
+    (SELECT device_kek FROM approved) AS kek
+"""
+
+#
+# Batch forms of the device statements above, each batch is a single
+# statement and thus a single transaction. $2 is a comma separated list
+# of device ids, every id gets a result row back.
+#
+SQL_DEVICE_APPROVE_BATCH = """
+WITH ids AS (
+    SELECT DISTINCT
+        unnest(string_to_array($2, ',')) AS id
+), pending AS (
+    SELECT
+        device_id, device_cathedral_id,
+        row_number() OVER (ORDER BY device_cathedral_id) AS n
+    FROM (
+        SELECT
+            device_id, device_cathedral_id
+        FROM
+            devices
+        WHERE
+            device_network_token = $1 AND
+            device_account = $3 AND
+            device_approved = 'f' AND
+            device_cathedral_id IN (SELECT id FROM ids)
+        FOR UPDATE
+    ) AS locked
+), slots AS (
+    SELECT
+        kek, row_number() OVER (ORDER BY kek) AS n
+    FROM
+        generate_series(1, 255) AS kek
+    WHERE
+        kek NOT IN (
+            SELECT
+                device_kek
+            FROM
+                devices
+            WHERE
+                device_network_token = $1 AND
+                device_approved = 't'
+        )
+), approved AS (
+    UPDATE
+        devices
+    SET
+        device_approved = 't', device_kek = slots.kek
+    FROM
+        pending JOIN slots USING (n)
+    WHERE
+        devices.device_id = pending.device_id
+    RETURNING
+        devices.device_cathedral_id, devices.device_kek
+)
+SELECT
+    ids.id AS device,
+    approved.device_kek AS kek,
+    pending.device_id IS NOT NULL AS pending
+FROM
+    ids
+    LEFT JOIN pending ON pending.device_cathedral_id = ids.id
+    LEFT JOIN approved ON approved.device_cathedral_id = ids.id
+ORDER BY
+    ids.id
+"""
+
+SQL_DEVICE_DELETE_BATCH = """
+WITH ids AS (
+    SELECT DISTINCT
+        unnest(string_to_array($2, ',')) AS id
+), deleted AS (
+    DELETE FROM
+        devices
+    WHERE
+        device_network_token = $1 AND
+        device_account = $3 AND
+        device_cathedral_id IN (SELECT id FROM ids)
+    RETURNING
+        device_cathedral_id
+)
+SELECT
+    ids.id AS device,
+    deleted.device_cathedral_id IS NOT NULL AS deleted
+FROM
+    ids
+    LEFT JOIN deleted ON deleted.device_cathedral_id = ids.id
+ORDER BY
+    ids.id
+"""
+
+SQL_DEVICE_CREATE_BATCH = """
+INSERT INTO devices
+    (
+        device_kek,
+        device_cathedral_id,
+        device_network,
+        device_cathedral_key,
+        device_account,
+        device_network_token,
+        device_pubkey
+    )
+SELECT
+    0, batch.id, $1, batch.key, $2, $3, batch.pubkey
+FROM
+    unnest(
+        string_to_array($4, ','),
+        string_to_array($5, ','),
+        string_to_array($6, ',')
+    ) AS batch(id, key, pubkey)
 RETURNING
-    device_kek
+    device_id
 """
 
 SQL_DEVICE_LIST = """
@@ -254,16 +466,6 @@ ORDER BY
     device_approved = 'f' DESC, device_kek ASC
 """
 
-SQL_DEVICE_LIST_ALL_FOR_NETWORK = """
-SELECT
-    device_kek, device_cathedral_id
-FROM
-devices
-    JOIN networks ON networks.network_id = devices.device_network
-WHERE
-    network_token = $1
-"""
-
 SQL_DEVICE_RENEW = """
 UPDATE
     devices
@@ -286,9 +488,128 @@ RETURNING
     device_cathedral_id
 """
 
+#
+# The maintenance statements below delete at most $1 rows per call and
+# report how many they deleted, fewer than $1 means nothing is left.
+#
+# The batch is handed to the DELETE as an array so it always looks the
+# rows up by primary key, an IN () lets the planner hash the batch and
+# scan the whole table for larger batches.
+#
 SQL_EXPIRE_TOKENS = """
-DELETE FROM
-    tokens
+WITH batch AS (
+    SELECT
+        token_id
+    FROM
+        tokens
+    WHERE
+        token_expires < EXTRACT(epoch FROM now())::int
+    ORDER BY
+        token_expires
+    LIMIT $1
+), deleted AS (
+    DELETE FROM
+        tokens
+    WHERE
+        token_id = ANY(ARRAY(SELECT token_id FROM batch))
+    RETURNING
+        token_id
+)
+SELECT
+    count(*) AS rows
+FROM
+    deleted
+"""
+
+#
+# Accounts that expired more than $2 seconds ago, deleting one removes
+# its tokens, flocks, devices and xflocks through the foreign keys.
+#
+SQL_EXPIRE_ACCOUNTS = """
+WITH batch AS (
+    SELECT
+        account_id
+    FROM
+        accounts
+    WHERE
+        account_time_left < EXTRACT(epoch FROM now())::int - $2
+    ORDER BY
+        account_time_left
+    LIMIT $1
+), deleted AS (
+    DELETE FROM
+        accounts
+    WHERE
+        account_id = ANY(ARRAY(SELECT account_id FROM batch))
+    RETURNING
+        account_id
+)
+SELECT
+    count(*) AS rows
+FROM
+    deleted
+"""
+
+#
+# How many rows the statements above have left to delete, counting at
+# most $1 of them.
+#
+SQL_EXPIRE_TOKENS_BACKLOG = """
+SELECT
+    count(*) AS rows
+FROM (
+    SELECT
+        1
+    FROM
+        tokens
+    WHERE
+        token_expires < EXTRACT(epoch FROM now())::int
+    LIMIT $1
+) AS backlog
+"""
+
+SQL_EXPIRE_ACCOUNTS_BACKLOG = """
+SELECT
+    count(*) AS rows
+FROM (
+    SELECT
+        1
+    FROM
+        accounts
+    WHERE
+        account_time_left < EXTRACT(epoch FROM now())::int - $2
+    LIMIT $1
+) AS backlog
+"""
+
+#
+# Which of the given ambry names, without the ambry- prefix, no longer
+# belong to an existing flock or established xflock.
+#
+SQL_AMBRY_ORPHANS = """
+SELECT
+    name
+FROM
+    unnest(string_to_array($1, ',')) AS name
 WHERE
-    token_expires < EXTRACT(epoch FROM now())
+    CASE WHEN position('_' IN name) = 0 THEN
+        NOT EXISTS (
+            SELECT
+                1
+            FROM
+                networks
+            WHERE
+                network_token = name
+        )
+    ELSE
+        NOT EXISTS (
+            SELECT
+                1
+            FROM
+                xflock_pairs
+            WHERE
+                pair_a = split_part(name, '_', 1) AND
+                pair_b = split_part(name, '_', 2)
+        )
+    END
 """
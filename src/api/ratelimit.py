@@ -14,37 +14,90 @@
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
 import kore
+import mmap
+import time
+import struct
+import hashlib
+import multiprocessing
 
-REQUESTS_PER_SECOND_LIMIT = 1
+#
+# Token bucket budgets per route class: (tokens per second, burst).
+# Route classes without their own entry share the default budget.
+#
+RATELIMIT_BUDGETS = {
+    "default": (1.0, 2),
+    "register": (1.0 / 60, 2),
+    "device-create": (1.0 / 5, 4),
+}
+
+#
+# The buckets live in a set-associative table in an anonymous shared
+# mapping that is created before the workers fork, so every worker
+# sees and updates the same buckets.
+#
+# A client hashes to one set of RATELIMIT_WAYS slots, each slot holds
+# the client key, its tokens and the time they were last refilled.
+# When a new client does not fit its set, the least recently used slot
+# in that set is taken over, so memory stays flat and every check
+# costs at most RATELIMIT_WAYS slot reads.
+#
+RATELIMIT_WAYS = 8
+RATELIMIT_LOCKS = 64
+RATELIMIT_SLOT = struct.Struct("=Qdd")
 
 class RateLimit:
-    def __init__(self, app):
+    def __init__(self, app, sets):
         self.app = app
-        self.clients = {}
-        kore.task_create(self.expire())
+        self.sets = sets
+        self.table = mmap.mmap(-1, sets * RATELIMIT_WAYS * RATELIMIT_SLOT.size)
+        self.locks = [multiprocessing.Lock() for _ in range(RATELIMIT_LOCKS)]
+
+    def budget(self, name):
+        if name in RATELIMIT_BUDGETS:
+            return name
+
+        return "default"
+
+    def key(self, client, budget):
+        digest = hashlib.blake2b(f"{client}/{budget}".encode(), digest_size=8)
+        return int.from_bytes(digest.digest(), "little") | 1
+
+    def check(self, client, name):
+        budget = self.budget(name)
+        rate, burst = RATELIMIT_BUDGETS[budget]
+
+        key = self.key(client, budget)
+        idx = key % self.sets
+        base = idx * RATELIMIT_WAYS
+        now = time.monotonic()
 
-    async def expire(self):
-        while True:
-            await kore.suspend(1000)
+        with self.locks[idx % RATELIMIT_LOCKS]:
+            slot = None
+            oldest = None
 
-            for client in self.clients:
-                bucket = self.clients[client]
-                size = len(bucket)
+            for way in range(base, base + RATELIMIT_WAYS):
+                offset = way * RATELIMIT_SLOT.size
+                current, tokens, stamp = RATELIMIT_SLOT.unpack_from(
+                    self.table, offset
+                )
 
-                if size > 0:
-                    path = bucket.pop(0)
-                    size = size - 1
+                if current == key:
+                    slot = offset
+                    tokens = min(burst, tokens + ((now - stamp) * rate))
+                    break
 
-    def check(self, client, path):
-        if not client in self.clients:
-            self.clients[client] = []
+                if oldest is None or current == 0 or stamp < oldest[1]:
+                    oldest = (offset, stamp)
 
-        bucket = self.clients[client]
+            if slot is None:
+                slot = oldest[0]
+                tokens = burst
 
-        if len(bucket) > REQUESTS_PER_SECOND_LIMIT:
-            kore.log(kore.LOG_NOTICE, f"{client} hit the rate-limit")
-            return False
+            if tokens < 1:
+                RATELIMIT_SLOT.pack_into(self.table, slot, key, tokens, now)
+                kore.log(kore.LOG_NOTICE, f"{client} hit the rate-limit")
+                return False
 
-        bucket.append(path)
+            RATELIMIT_SLOT.pack_into(self.table, slot, key, tokens - 1, now)
 
         return True
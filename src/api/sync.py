@@ -17,57 +17,288 @@ import kore
 
 import os
 import time
+import heapq
 import signal
+import hashlib
 
-SQL_GET_FLOCKS_WITH_TIME_LEFT = """
-SELECT DISTINCT
-    network_token
+from fileio import FileIO, FILEIO_SYSCALLS
+
+SYNC_INTERVAL = 30
+
+#
+# A sync cycle is a single statement so that everything it returns comes
+# from one snapshot: the flock stanzas with their approved devices, the
+# xflock bindings and the cathedrals to federate with. The change log is
+# drained by the same statement.
+#
+# Every row carries a kind:
+#   flock       one row per approved device of an exported flock, or a
+#               single row with NULL device columns for an empty flock,
+#               expires holds the account_time_left of its owner
+#   xflock      one row per established xflock pair
+#   federate    cathedrals for settings.conf
+#   shrouded    cathedrals for settings-shroud.conf
+#   touched     flocks that changed since the last cycle
+#   xtouched    flocks whose xflock bindings changed
+#
+SQL_SYNC_REBUILD = """
+WITH changes AS (
+    DELETE FROM flock_changes RETURNING change_id
+),
+flocks AS (
+    SELECT DISTINCT
+        network_token, accounts.account_time_left AS expires
+    FROM
+        networks, accounts
+    WHERE
+        networks.network_owner = accounts.account_id AND
+        accounts.account_time_left > EXTRACT(epoch FROM now())::int AND
+        networks.network_ambry_update != 0
+)
+
+SELECT
+    'flock' AS kind,
+    flocks.network_token AS token,
+    devices.device_id AS seq,
+    devices.device_cathedral_id AS cid,
+    devices.device_kek AS kek,
+    devices.device_cathedral_key AS key,
+    devices.device_pubkey AS pubkey,
+    devices.device_bw_limit AS bw_limit,
+    flocks.expires AS expires
 FROM
-    networks, accounts
-WHERE
-    networks.network_owner = accounts.account_id AND
-    accounts.account_time_left > EXTRACT(epoch FROM now()) AND
-    networks.network_ambry_update != 0
-"""
+    flocks
+LEFT JOIN
+    devices ON devices.device_network_token = flocks.network_token AND
+    devices.device_approved = 't'
+
+UNION ALL
 
-SQL_GET_CATHEDRALS = """
 SELECT
-    cathedral_ip, cathedral_port
+    'xflock', pair_a, NULL, pair_b, NULL, NULL, NULL, NULL, NULL
 FROM
-    cathedrals
-WHERE
-    cathedral_shrouded = 't'
-"""
+    xflock_pairs
+
+UNION ALL
 
-SQL_GET_CATHEDRALS_OLD = """
 SELECT
-    cathedral_ip, cathedral_port
+    CASE WHEN cathedral_shrouded THEN 'shrouded' ELSE 'federate' END,
+    cathedral_ip, cathedral_port, NULL, NULL, NULL, NULL, NULL, NULL
 FROM
     cathedrals
 WHERE
-    cathedral_shrouded = 'f'
+    cathedral_shrouded IS NOT NULL
+
+ORDER BY
+    1, 2, 3
 """
 
-SQL_GET_DEVICES_PER_FLOCK = """
+SQL_SYNC_REFRESH = """
+WITH changes AS (
+    DELETE FROM flock_changes RETURNING change_kind, change_token
+),
+touched AS (
+    SELECT
+        change_token AS network_token
+    FROM
+        changes
+    WHERE
+        change_kind = 'flock'
+),
+flocks AS (
+    SELECT DISTINCT
+        network_token, accounts.account_time_left AS expires
+    FROM
+        networks, accounts
+    WHERE
+        networks.network_owner = accounts.account_id AND
+        accounts.account_time_left > EXTRACT(epoch FROM now())::int AND
+        networks.network_ambry_update != 0 AND
+        networks.network_token IN (SELECT network_token FROM touched)
+),
+xtouched AS (
+    SELECT DISTINCT
+        change_token AS network_token
+    FROM
+        changes
+    WHERE
+        change_kind = 'xflock'
+),
+xpairs AS (
+    SELECT
+        pair_a, pair_b
+    FROM
+        xflock_pairs
+    JOIN
+        xtouched ON xtouched.network_token = xflock_pairs.pair_a
+
+    UNION
+
+    SELECT
+        pair_a, pair_b
+    FROM
+        xflock_pairs
+    JOIN
+        xtouched ON xtouched.network_token = xflock_pairs.pair_b
+)
+
+SELECT
+    'flock' AS kind,
+    flocks.network_token AS token,
+    devices.device_id AS seq,
+    devices.device_cathedral_id AS cid,
+    devices.device_kek AS kek,
+    devices.device_cathedral_key AS key,
+    devices.device_pubkey AS pubkey,
+    devices.device_bw_limit AS bw_limit,
+    flocks.expires AS expires
+FROM
+    flocks
+LEFT JOIN
+    devices ON devices.device_network_token = flocks.network_token AND
+    devices.device_approved = 't'
+
+UNION ALL
+
+SELECT
+    'touched', network_token, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+FROM
+    touched
+
+UNION ALL
+
+SELECT
+    'xtouched', network_token, NULL, NULL, NULL, NULL, NULL, NULL, NULL
+FROM
+    xtouched
+
+UNION ALL
+
 SELECT
-    device_kek,
-    device_cathedral_id,
-    device_cathedral_key,
-    device_pubkey,
-    device_bw_limit
+    'xflock', pair_a, NULL, pair_b, NULL, NULL, NULL, NULL, NULL
 FROM
-    devices
+    xpairs
+
+UNION ALL
+
+SELECT
+    CASE WHEN cathedral_shrouded THEN 'shrouded' ELSE 'federate' END,
+    cathedral_ip, cathedral_port, NULL, NULL, NULL, NULL, NULL, NULL
+FROM
+    cathedrals
 WHERE
-    device_network_token = $1 AND device_approved = 't'
+    cathedral_shrouded IS NOT NULL
+
+ORDER BY
+    1, 2, 3
 """
 
-SQL_GET_XFLOCKS = """
+#
+# The current deadline of the given flocks, re-read right before they
+# are dropped so that an account that was given more time in the mean
+# time keeps its flocks.
+#
+SQL_SYNC_EXPIRES = """
 SELECT
-    xflock_src_token, xflock_dst_token
+    networks.network_token AS token,
+    accounts.account_time_left AS expires
 FROM
-    xflocks
+    networks
+JOIN
+    accounts ON accounts.account_id = networks.network_owner
+WHERE
+    networks.network_token = ANY(string_to_array($1, ','))
 """
 
+#
+# Keeps the identity files under shared/identities in line with the
+# approved devices of the exported flocks.
+#
+# The manifest remembers a content hash per file for every flock-<token>
+# directory, it is populated from disk once and then kept current so
+# that only new or changed identities are written and identities for
+# devices or flocks that went away are removed.
+#
+class Identities:
+    def __init__(self, path):
+        self.path = path
+        self.manifest = None
+
+    def load(self):
+        self.manifest = {}
+        os.makedirs(self.path, exist_ok=True)
+
+        for entry in os.listdir(self.path):
+            if not entry.startswith("flock-"):
+                continue
+
+            files = {}
+            directory = f"{self.path}/{entry}"
+
+            for name in os.listdir(directory):
+                if name.endswith(".tmp"):
+                    os.unlink(f"{directory}/{name}")
+                    continue
+
+                with open(f"{directory}/{name}", "rb") as f:
+                    files[name] = hashlib.sha256(f.read()).digest()
+
+            self.manifest[entry[6:]] = files
+
+    def tokens(self):
+        return list(self.manifest.keys())
+
+    def update(self, token, desired):
+        directory = f"{self.path}/flock-{token}"
+        current = self.manifest.get(token)
+
+        if current is None:
+            os.makedirs(directory, exist_ok=True)
+            current = {}
+            self.manifest[token] = current
+
+        for name, data in desired.items():
+            digest = hashlib.sha256(data).digest()
+            if current.get(name) == digest:
+                continue
+
+            path = f"{directory}/{name}"
+            tmppath = f"{path}.tmp"
+
+            with open(tmppath, "wb") as f:
+                f.write(data)
+
+            os.rename(tmppath, path)
+            current[name] = digest
+
+        for name in list(current.keys()):
+            if name in desired:
+                continue
+
+            self.unlink(f"{directory}/{name}")
+            del current[name]
+
+    def remove(self, token):
+        files = self.manifest.pop(token, None)
+        if files is None:
+            return
+
+        directory = f"{self.path}/flock-{token}"
+
+        for name in files:
+            self.unlink(f"{directory}/{name}")
+
+        try:
+            os.rmdir(directory)
+        except OSError as e:
+            kore.log(kore.LOG_NOTICE, f"failed to remove {directory}: {e}")
+
+    def unlink(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
 class Sync:
     def allow(self, seccomp, name):
         try:
@@ -80,9 +311,23 @@ class Sync:
         self.allow(seccomp, "mkdirat")
         self.allow(seccomp, "renameat")
         self.allow(seccomp, "rename")
+        self.allow(seccomp, "unlink")
+        self.allow(seccomp, "unlinkat")
+        self.allow(seccomp, "rmdir")
+
+        for name in FILEIO_SYSCALLS:
+            self.allow(seccomp, name)
 
     def configure(self, args):
         self.counter = 0
+        self.full = True
+        self.expiry = {}
+        self.deadlines = []
+        self.flocks = {}
+        self.xflocks = {}
+        self.written = {}
+        self.federate = {"federate": [], "shrouded": []}
+        self.fileio = FileIO(1)
         kore.config.workers = 1
         #kore.config.seccomp_tracing = "yes"
         kore.config.pidfile = "/tmp/sync.pid"
@@ -95,6 +340,7 @@ class Sync:
             "SYNC_SHARED_PATH", default="shared"
         )
 
+        self.identities = Identities(f"{self.shared_path}/identities")
         self.settings_path_old = f"{self.shared_path}/settings.conf"
         self.settings_path = f"{self.shared_path}/settings-shroud.conf"
 
@@ -109,13 +355,21 @@ class Sync:
         kore.dbsetup("db", f"host={self.dbhost} dbname=accounts")
         kore.task_create(self.run())
 
+    #
+    # The settings body is kept as a list of chunks, mostly the cached
+    # flock stanzas themselves, and streamed to both settings files so
+    # only a single copy of it ever exists.
+    #
     def config_reset(self):
-        self.cfg = ""
+        self.cfg = []
 
     def config(self, line):
-        self.cfg += line + "\n"
+        self.cfg.append(line + "\n")
+
+    def config_write(self, path, digest, federate):
+        if self.written.get(path) == digest:
+            return False
 
-    def config_write(self, path):
         try:
             tmppath = f"{path}.tmp"
 
@@ -128,126 +382,265 @@ class Sync:
             )
 
             with open(fd, "w") as f:
-                f.write(self.cfg)
+                f.write(f"# settings {self.counter}\n")
+                f.writelines(self.cfg)
+                f.writelines(federate)
 
             os.rename(tmppath, path)
+            self.written[path] = digest
         except Exception as e:
             kore.log(kore.LOG_NOTICE, f"failed to write settings {e}")
 
+        return True
+
     async def run(self):
+        poll = 0
+
         while True:
             try:
-                kore.log(kore.LOG_INFO, f"sync {self.counter} started")
-
-                self.config_reset()
-                self.config(f"# settings {self.counter}")
-
-                flocks = await kore.dbquery("db", SQL_GET_FLOCKS_WITH_TIME_LEFT)
-                for flock in flocks:
-                    await self.flock_sync(flock)
-
-                xflocks = await self.resolve_xflocks()
-                for key, count in xflocks.items():
-                    if count != 2:
-                        continue
-                    flock_a, flock_b = key
-                    ambry = "/home/cathedral/shared/ambries/"
-                    ambry += f"ambry-{flock_a}_{flock_b}"
-                    self.config(f"xflock {flock_a} {flock_b} {ambry}")
-
-                cfg = self.cfg
-                cathedrals = await kore.dbquery("db", SQL_GET_CATHEDRALS_OLD)
-                for cathedral in cathedrals:
-                    ip = cathedral["cathedral_ip"]
-                    port = cathedral["cathedral_port"]
-                    self.config(f"federate {ip} {port}")
-
-                self.config_write(self.settings_path_old)
-
-                self.cfg = cfg
-                cathedrals = await kore.dbquery("db", SQL_GET_CATHEDRALS)
-                for cathedral in cathedrals:
-                    ip = cathedral["cathedral_ip"]
-                    port = cathedral["cathedral_port"]
-                    self.config(f"federate {ip} {port}")
-
-                self.config_write(self.settings_path)
-
-                kore.log(kore.LOG_INFO, f"sync {self.counter} completed")
-                self.counter = self.counter + 1
+                if self.full:
+                    kore.log(kore.LOG_INFO, "sync full rebuild started")
+                    await self.rebuild()
+                    poll = time.monotonic() + SYNC_INTERVAL
+                elif time.monotonic() >= poll:
+                    await self.refresh()
+                    poll = time.monotonic() + SYNC_INTERVAL
+
+                await self.expire()
+
+                if await self.fileio.run(self.publish):
+                    kore.log(kore.LOG_INFO, f"sync {self.counter} completed")
+                    self.counter = self.counter + 1
             except Exception as e:
+                self.full = True
+                poll = time.monotonic() + SYNC_INTERVAL
                 kore.log(kore.LOG_NOTICE, f"sync failed: {e}")
 
-            await kore.suspend(30 * 1000)
+            wait = max(0, poll - time.monotonic())
+            if len(self.deadlines) > 0:
+                wait = min(wait, max(0, self.deadlines[0][0] - time.time()))
+
+            await kore.suspend(int(wait * 1000) + 1)
+
+    #
+    # Drop the flocks whose account ran out of time. Every exported
+    # flock has its deadline in the heap, entries that no longer match
+    # self.expiry are left overs from an older export and are skipped.
+    #
+    # An account that gets more time shows up in the change log, but
+    # that can land after its old deadline and before the next refresh,
+    # so the deadlines that are due are read again first and flocks
+    # whose account was extended only get their new deadline.
+    #
+    async def expire(self):
+        now = time.time()
+        due = []
+        expired = set()
+
+        while len(self.deadlines) > 0 and self.deadlines[0][0] <= now:
+            deadline, token = heapq.heappop(self.deadlines)
+            if self.expiry.get(token) == deadline:
+                due.append(token)
+
+        if len(due) == 0:
+            return
+
+        rows = await kore.dbquery("db", SQL_SYNC_EXPIRES, [",".join(due)])
+        current = {row["token"]: int(row["expires"]) for row in rows}
+
+        for token in due:
+            expires = current.get(token, 0)
+
+            if expires > now:
+                self.deadline(token, expires)
+                continue
+
+            del self.expiry[token]
+
+            if self.flocks.pop(token, None) is not None:
+                kore.log(kore.LOG_INFO, f"flock {token} expired")
+                expired.add(token)
+
+        if len(expired) == 0:
+            return
+
+        self.staged = {}
+        self.removed = expired
+
+        await self.fileio.run(self.identities_sync)
+
+    #
+    # Export every active flock from scratch. The change log is drained
+    # in the same snapshot so that anything changing after it is picked
+    # up again on the next cycle instead of being lost.
+    #
+    async def rebuild(self):
+        rows = await kore.dbquery("db", SQL_SYNC_REBUILD)
+
+        if self.identities.manifest is None:
+            await self.fileio.run(self.identities.load)
+
+        self.flocks = {}
+        self.xflocks = {}
+        self.expiry = {}
+        self.deadlines = []
+        self.export(rows)
+
+        for token in self.identities.tokens():
+            if token not in self.flocks:
+                self.removed.add(token)
+
+        await self.fileio.run(self.identities_sync)
+        self.full = False
+
+    #
+    # Only re-export the flocks that showed up in the change log, expiry
+    # is handled by expire().
+    #
+    async def refresh(self):
+        rows = await kore.dbquery("db", SQL_SYNC_REFRESH)
+        self.export(rows)
+
+        await self.fileio.run(self.identities_sync)
+
+    #
+    # Group the rows of a cycle into flock stanzas in one pass, rows
+    # for the same flock arrive back to back.
+    #
+    # The identity files are only staged here and written out by
+    # identities_sync() on the file I/O thread afterwards.
+    #
+    def export(self, rows):
+        self.staged = {}
+        self.removed = set()
+
+        touched = set()
+        exported = set()
+        xtouched = set()
+        xflocks = []
+        federate = {"federate": [], "shrouded": []}
+
+        token = None
+        devices = []
+
+        for row in rows:
+            kind = row["kind"]
+
+            if kind == "flock":
+                if row["token"] != token:
+                    if token is not None:
+                        self.flock_sync(token, devices)
+                        exported.add(token)
+                    token = row["token"]
+                    devices = []
+                    self.deadline(token, int(row["expires"]))
+                if row["cid"] is not None:
+                    devices.append(row)
+            elif kind == "touched":
+                touched.add(row["token"])
+            elif kind == "xtouched":
+                xtouched.add(row["token"])
+            elif kind == "xflock":
+                xflocks.append((row["token"], row["cid"]))
+            else:
+                federate[kind].append(f"federate {row['token']} {row['seq']}")
 
-    async def flock_sync(self, flock):
-        token = flock["network_token"]
-        kore.log(kore.LOG_INFO, f"syncing {flock}")
+        if token is not None:
+            self.flock_sync(token, devices)
+            exported.add(token)
 
-        devices = await kore.dbquery("db",
-            SQL_GET_DEVICES_PER_FLOCK,
-            params=[token]
-        )
+        for token in touched - exported:
+            self.flocks.pop(token, None)
+            self.expiry.pop(token, None)
+            self.removed.add(token)
 
-        self.config(f"flock {token} {{")
+        if len(xtouched) > 0:
+            for key in list(self.xflocks.keys()):
+                if key[0] in xtouched or key[1] in xtouched:
+                    del self.xflocks[key]
 
-        path = f"{self.shared_path}/identities"
-        os.makedirs(path, exist_ok=True)
+        for flock_a, flock_b in xflocks:
+            ambry = "/home/cathedral/shared/ambries/"
+            ambry += f"ambry-{flock_a}_{flock_b}"
+            line = f"xflock {flock_a} {flock_b} {ambry}"
+            self.xflocks[(flock_a, flock_b)] = line
 
-        path = f"{self.shared_path}/identities/flock-{token}"
-        os.makedirs(path, exist_ok=True)
+        self.federate = federate
 
-        for device in devices:
-            kek = hex(int(device["device_kek"]))
-            pubkey = device["device_pubkey"]
-            limit = device["device_bw_limit"]
-            cid = device["device_cathedral_id"]
-            key = device["device_cathedral_key"]
+    #
+    # Write out both settings files, each one is only replaced when
+    # its contents differ from what we wrote last time.
+    #
+    def publish(self):
+        self.config_reset()
+        self.cfg.extend(self.flocks.values())
 
-            path = f"{self.shared_path}/identities/flock-{token}/{cid}.key"
-            tmppath = f"{path}.tmp"
+        for line in self.xflocks.values():
+            self.config(line)
 
-            with open(tmppath, "wb") as f:
-                f.write(bytes.fromhex(key))
+        body = hashlib.sha256()
+        for chunk in self.cfg:
+            body.update(chunk.encode())
 
-            os.rename(tmppath, path)
+        changed = False
+        settings = [
+            (self.settings_path_old, self.federate["federate"]),
+            (self.settings_path, self.federate["shrouded"]),
+        ]
 
-            if pubkey != "NO-KEY":
-                path = f"{self.shared_path}/identities/flock-{token}/{cid}.pub"
-                tmppath = f"{path}.tmp"
-                with open(tmppath, "wb") as f:
-                    f.write(bytes.fromhex(pubkey))
-                os.rename(tmppath, path)
+        for path, cathedrals in settings:
+            digest = body.copy()
+            federate = [f"{line}\n" for line in cathedrals]
 
-            self.config(f"\tallow {cid} spi {kek} {limit}")
+            for line in federate:
+                digest.update(line.encode())
 
-        self.config(f"\tambry /home/cathedral/shared/ambries/ambry-{token}")
-        self.config("}")
+            if self.config_write(path, digest.digest(), federate):
+                changed = True
 
-    async def resolve_xflocks(self):
-        xflocks = {}
+        return changed
 
-        res = await kore.dbquery("db", SQL_GET_XFLOCKS)
+    def deadline(self, token, expires):
+        if self.expiry.get(token) == expires:
+            return
 
-        for row in res:
-            flock_a = int(row["xflock_src_token"], 16)
-            flock_b = int(row["xflock_dst_token"], 16)
+        self.expiry[token] = expires
+        heapq.heappush(self.deadlines, (expires, token))
 
-            if flock_b < flock_a:
-                tmp = row["xflock_src_token"]
-                flock_a = row["xflock_dst_token"]
-                flock_b = tmp
-            else:
-                flock_a = row["xflock_src_token"]
-                flock_b = row["xflock_dst_token"]
+    def flock_sync(self, token, devices):
+        kore.log(kore.LOG_INFO, f"syncing {token}")
 
-            xt = (flock_a, flock_b)
+        identities = {}
+        stanza = [f"flock {token} {{\n"]
 
-            if not xt in xflocks:
-                xflocks[xt] = 1
-            else:
-                xflocks[xt] = xflocks[xt] + 1
+        for device in devices:
+            kek = hex(int(device["kek"]))
+            pubkey = device["pubkey"]
+            limit = device["bw_limit"]
+            cid = device["cid"]
+            key = device["key"]
+
+            identities[f"{cid}.key"] = bytes.fromhex(key)
+
+            if pubkey != "NO-KEY":
+                identities[f"{cid}.pub"] = bytes.fromhex(pubkey)
+
+            stanza.append(f"\tallow {cid} spi {kek} {limit}\n")
+
+        stanza.append(f"\tambry /home/cathedral/shared/ambries/ambry-{token}\n")
+        stanza.append("}\n")
+
+        self.staged[token] = identities
+        self.flocks[token] = "".join(stanza)
+
+    def identities_sync(self):
+        for token, identities in self.staged.items():
+            self.identities.update(token, identities)
+
+        for token in self.removed:
+            self.identities.remove(token)
 
-        return xflocks
+        self.staged = {}
+        self.removed = set()
 
 koreapp = Sync()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Lets the deadlines of two exported flocks come due while the account
+# of one of them was given more time through /account/time and checks
+# that sync only drops the other one, and that the extended flock is
+# dropped once its new deadline passes.
+#
+# The database is a fake query result, no Kore or database required.
+#
+#   $ python3 src/api/tests/expiry.py
+#
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, f"{API}/bench")
+
+import korestub
+
+def check(failed, name, ok):
+    print(f"{'ok    ' if ok else 'FAILED'} {name}")
+    return failed + (0 if ok else 1)
+
+def main():
+    failed = 0
+
+    with tempfile.TemporaryDirectory() as path:
+        os.environ["SYNC_SHARED_PATH"] = path
+
+        import sync
+
+        app = sync.koreapp
+        app.configure([])
+        app.identities.load()
+
+        now = int(time.time())
+        accounts = {"extended": now + 3600, "lapsed": now - 1}
+
+        async def query(db, sql, params=None):
+            tokens = params[0].split(",")
+            return [{"token": t, "expires": str(accounts[t])} for t in tokens]
+
+        korestub.dbquery = query
+
+        for token in accounts:
+            app.staged = {token: {"00000001.key": b"key"}}
+            app.removed = set()
+            app.flocks[token] = f"flock {token} {{\n}}\n"
+            app.deadline(token, now - 1)
+            app.identities_sync()
+
+        asyncio.run(app.expire())
+
+        failed = check(failed, "extended flock kept",
+            "extended" in app.flocks and
+            app.expiry.get("extended") == accounts["extended"] and
+            os.path.isdir(f"{path}/identities/flock-extended"))
+
+        failed = check(failed, "lapsed flock dropped",
+            "lapsed" not in app.flocks and "lapsed" not in app.expiry and
+            not os.path.exists(f"{path}/identities/flock-lapsed"))
+
+        accounts["extended"] = now - 1
+        app.deadline("extended", now - 1)
+        asyncio.run(app.expire())
+
+        failed = check(failed, "extended flock dropped at its new deadline",
+            "extended" not in app.flocks and
+            not os.path.exists(f"{path}/identities/flock-extended"))
+
+    if failed != 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
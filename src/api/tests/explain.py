@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Checks that the hot statements are planned on top of the indexes from
+# the migrations instead of scanning whole tables.
+#
+# Creates a scratch database on a local PostgreSQL, loads schema.sql,
+# applies every migration through migrate.py, fills it with enough rows
+# for the planner to care and runs EXPLAIN on each statement. Any
+# sequential scan on one of the listed tables fails the check, and so
+# does walking one of their indexes without an index condition, which
+# is what a predicate the index cannot be used for turns into when the
+# statement also orders by the indexed column.
+#
+#   $ python3 src/api/tests/explain.py
+#
+# DBHOST selects the server like it does for migrate.py, EXPLAIN_DB
+# names the scratch database, which is dropped and recreated.
+#
+
+import os
+import re
+import sys
+import json
+import psycopg2
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API)
+sys.path.insert(0, f"{API}/bench")
+
+import korestub
+import migrate
+
+from queries import *
+from sync import SQL_SYNC_REBUILD, SQL_SYNC_REFRESH, SQL_SYNC_EXPIRES
+
+ACCOUNTS = 20000
+
+SQL_POPULATE = [
+    f"""
+    INSERT INTO accounts (account_key, account_time_left)
+    SELECT
+        'key-' || i,
+        CASE WHEN i % 100 = 0
+            THEN EXTRACT(epoch FROM now())::int - 86400 * 90
+            ELSE EXTRACT(epoch FROM now())::int + 86400
+        END
+    FROM
+        generate_series(1, {ACCOUNTS}) AS i
+    """,
+    f"""
+    INSERT INTO tokens (token_value, token_account, token_expires)
+    SELECT
+        'tok-' || i, (i % {ACCOUNTS}) + 1,
+        CASE WHEN i % 100 = 0
+            THEN EXTRACT(epoch FROM now())::int - 60
+            ELSE EXTRACT(epoch FROM now())::int + 2592000
+        END
+    FROM
+        generate_series(1, {ACCOUNTS * 5}) AS i
+    """,
+    f"""
+    INSERT INTO networks (network_token, network_owner, network_ambry_update)
+    SELECT
+        'flock-' || i, (i % {ACCOUNTS}) + 1, 1
+    FROM
+        generate_series(1, {ACCOUNTS * 2}) AS i
+    """,
+    f"""
+    INSERT INTO devices
+        (device_kek, device_cathedral_id, device_cathedral_key,
+        device_network, device_account, device_network_token,
+        device_approved)
+    SELECT
+        CASE WHEN (i / {ACCOUNTS * 2}) % 2 = 0
+            THEN (i / {ACCOUNTS * 2}) + 1
+            ELSE 0
+        END,
+        lpad(to_hex(i), 8, '0'), 'key', n.network_id, n.network_owner,
+        n.network_token, (i / {ACCOUNTS * 2}) % 2 = 0
+    FROM
+        generate_series(1, {ACCOUNTS * 2 * 10}) AS i
+    JOIN
+        networks n ON n.network_id = (i % {ACCOUNTS * 2}) + 1
+    """,
+    # The xflock triggers take an advisory lock per row, too many
+    # for one transaction, the pairs are filled in by hand instead.
+    "SET session_replication_role = replica",
+    f"""
+    INSERT INTO xflocks
+        (xflock_src, xflock_src_token, xflock_dst, xflock_dst_token,
+        xflock_owner)
+    SELECT
+        a.network_id, a.network_token, b.network_id, b.network_token,
+        a.network_owner
+    FROM
+        networks a
+    JOIN
+        networks b ON b.network_id = (a.network_id % {ACCOUNTS * 2}) + 1
+    """,
+    """
+    INSERT INTO xflocks
+        (xflock_src, xflock_src_token, xflock_dst, xflock_dst_token,
+        xflock_owner)
+    SELECT
+        x.xflock_dst, x.xflock_dst_token, x.xflock_src, x.xflock_src_token,
+        n.network_owner
+    FROM
+        xflocks x
+    JOIN
+        networks n ON n.network_id = x.xflock_dst
+    WHERE
+        x.xflock_src % 2 = 0
+    """,
+    """
+    INSERT INTO xflock_pairs (pair_a, pair_b)
+    SELECT DISTINCT
+        LEAST(a.xflock_src_token, a.xflock_dst_token),
+        GREATEST(a.xflock_src_token, a.xflock_dst_token)
+    FROM
+        xflocks a
+    JOIN
+        xflocks b ON b.xflock_src = a.xflock_dst AND
+        b.xflock_dst = a.xflock_src
+    """,
+    "SET session_replication_role = DEFAULT",
+    "DELETE FROM flock_changes",
+    # A sync cycle worth of changes for the refresh statement.
+    """
+    INSERT INTO flock_changes (change_kind, change_token)
+    SELECT
+        CASE WHEN i % 2 = 0 THEN 'flock' ELSE 'xflock' END,
+        'flock-' || (i * 37)
+    FROM
+        generate_series(1, 100) AS i
+    """,
+]
+
+#
+# The functions from 0006-hot-lookups.sql, their parameters and the
+# tables they may not scan in full. An EXPLAIN of the function call
+# does not show the plan of the query inside, so the query is taken
+# from the installed function and checked on its own.
+#
+FUNCTIONS = [
+    ("token-lookup", "api_account_from_token",
+        ["tok-5", "f"], ["tokens", "accounts"]),
+    ("network-get", "api_network_get",
+        ["flock-5", "6"], ["networks"]),
+]
+
+#
+# Statement, its parameters and the tables it may not scan in full.
+#
+CHECKS = [
+    ("account-from-key", SQL_ACCOUNT_FROM_KEY,
+        ["key-5"], ["accounts"]),
+    ("token-refresh", SQL_TOKEN_REFRESH,
+        ["tok-5,tok-6,tok-7"], ["tokens"]),
+    ("network-get-unauthed", SQL_NETWORK_GET_UNAUTHED,
+        ["flock-5"], ["networks"]),
+    ("network-delete", SQL_NETWORK_DELETE,
+        ["flock-5", "6"], ["networks"]),
+    ("network-list", SQL_NETWORK_LIST,
+        ["5"], ["networks", "accounts"]),
+    ("network-ambry-update", SQL_NETWORK_AMBRY_UPDATE,
+        ["flock-5", "6"], ["networks"]),
+    ("device-list", SQL_DEVICE_LIST,
+        ["flock-5", "6"], ["devices", "networks"]),
+    ("device-approve", SQL_DEVICE_APPROVE,
+        ["flock-5", "00000005", "6"], ["devices"]),
+    ("device-delete", SQL_DEVICE_DELETE,
+        ["flock-5", "00000005", "6"], ["devices"]),
+    ("device-approve-batch", SQL_DEVICE_APPROVE_BATCH,
+        ["flock-5", "00000005,00000006", "6"], ["devices"]),
+    ("device-delete-batch", SQL_DEVICE_DELETE_BATCH,
+        ["flock-5", "00000005,00000006", "6"], ["devices"]),
+    ("device-create-batch", SQL_DEVICE_CREATE_BATCH,
+        ["5", "6", "flock-5", "a0000001,a0000002", "key,key", ","],
+        ["devices"]),
+    ("xflock-create", SQL_XFLOCK_CREATE,
+        ["flock-5", "flock-6", "6"], ["networks", "xflocks"]),
+    ("xflock-delete", SQL_XFLOCK_DELETE,
+        ["flock-5", "flock-6", "6"], ["xflocks"]),
+    ("xflock-list", SQL_XFLOCK_LIST,
+        ["5"], ["xflocks"]),
+    ("xflock-list-for-flock", SQL_XFLOCK_LIST_FOR_FLOCK,
+        ["flock-5", "6"], ["xflocks", "networks"]),
+    ("xflock-access", SQL_XFLOCK_ACCESS,
+        ["flock-5", "flock-6", "6"], ["networks", "xflock_pairs"]),
+    ("ambry-orphans", SQL_AMBRY_ORPHANS,
+        ["flock-5,flock-6,flock-5_flock-6"], ["networks", "xflock_pairs"]),
+    ("expire-tokens", SQL_EXPIRE_TOKENS,
+        ["1000"], ["tokens"]),
+    ("expire-accounts", SQL_EXPIRE_ACCOUNTS,
+        ["1000", "2592000"], ["accounts"]),
+    ("expire-tokens-backlog", SQL_EXPIRE_TOKENS_BACKLOG,
+        ["100000"], ["tokens"]),
+    ("expire-accounts-backlog", SQL_EXPIRE_ACCOUNTS_BACKLOG,
+        ["100000", "2592000"], ["accounts"]),
+    # Exports every flock by design, only checked to plan at all.
+    ("sync-rebuild", SQL_SYNC_REBUILD,
+        [], []),
+    ("sync-refresh", SQL_SYNC_REFRESH,
+        [], ["networks", "accounts", "devices", "xflock_pairs"]),
+    ("sync-expires", SQL_SYNC_EXPIRES,
+        ["flock-5,flock-6"], ["networks", "accounts"]),
+]
+
+#
+# The query a PL/pgSQL function returns, with its input arguments
+# replaced by positional parameters in the order they are declared.
+#
+def function_query(cur, name):
+    cur.execute("SELECT prosrc, proargnames[1:pronargs] FROM pg_proc "
+        "WHERE proname = %s", [name])
+    body, args = cur.fetchone()
+
+    match = re.search("RETURN QUERY(.*?);", body, re.DOTALL)
+    if match is None:
+        raise RuntimeError(f"{name}: no RETURN QUERY in function body")
+
+    sql = match.group(1)
+    for idx, arg in enumerate(args, 1):
+        sql = re.sub(f"\\b{arg}\\b", f"${idx}", sql)
+
+    return sql
+
+def fullscans(plan, tables):
+    result = []
+    relation = plan.get("Relation Name")
+
+    if relation in tables:
+        if plan["Node Type"] == "Seq Scan":
+            result.append(f"sequential scan on {relation}")
+        elif plan["Node Type"] in ("Index Scan", "Index Only Scan") and \
+            "Index Cond" not in plan:
+            result.append(f"unbounded {plan['Index Name']} scan")
+
+    for child in plan.get("Plans", []):
+        result.extend(fullscans(child, tables))
+
+    return result
+
+#
+# Loads schema.sql and applies every migration through migrate.py.
+#
+def install(conn):
+    cur = conn.cursor()
+
+    with open(f"{API}/schema.sql", "r") as f:
+        cur.execute(f.read())
+
+    cur.execute(migrate.SQL_MIGRATIONS_CREATE)
+    conn.commit()
+
+    path = f"{API}/migrations"
+    for version, name in migrate.migrations(path):
+        with open(f"{path}/{name}", "r") as f:
+            migrate.apply(conn, cur, version, name, f.read())
+        conn.commit()
+
+def setup(dbhost, dbname):
+    admin = psycopg2.connect(f"host={dbhost} dbname=postgres")
+    admin.autocommit = True
+    cur = admin.cursor()
+    cur.execute(f"DROP DATABASE IF EXISTS {dbname}")
+    cur.execute(f"CREATE DATABASE {dbname}")
+    admin.close()
+
+    conn = psycopg2.connect(f"host={dbhost} dbname={dbname}")
+    install(conn)
+    cur = conn.cursor()
+
+    for sql in SQL_POPULATE:
+        cur.execute(sql)
+    conn.commit()
+
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE")
+    conn.autocommit = False
+
+    return conn
+
+def main():
+    dbhost = os.getenv("DBHOST", default="/var/run/postgresql")
+    dbname = os.getenv("EXPLAIN_DB", default="reliquary_explain")
+
+    conn = setup(dbhost, dbname)
+    cur = conn.cursor()
+    cur.execute("SET plan_cache_mode = force_custom_plan")
+
+    failed = 0
+    checks = [(name, function_query(cur, function), params, tables)
+        for name, function, params, tables in FUNCTIONS]
+
+    for name, sql, params, tables in checks + CHECKS:
+        cur.execute(f"PREPARE check_stmt AS {sql}")
+
+        if len(params) == 0:
+            cur.execute("EXPLAIN (FORMAT JSON) EXECUTE check_stmt")
+        else:
+            args = ", ".join(["%s"] * len(params))
+            cur.execute(f"EXPLAIN (FORMAT JSON) EXECUTE check_stmt({args})",
+                params)
+
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        scans = fullscans(plan[0]["Plan"], tables)
+        cur.execute("DEALLOCATE check_stmt")
+
+        if len(scans) == 0:
+            print(f"ok     {name}")
+            continue
+
+        failed += 1
+        print(f"FAILED {name}: {', '.join(scans)}")
+
+    conn.rollback()
+    conn.close()
+
+    if failed != 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
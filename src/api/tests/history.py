@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Publishes more versions of an ambry than AMBRY_HISTORY keeps and
+# checks after every upload that the history holds exactly as many
+# versions as it should, that identical uploads leave it alone and
+# that removing the ambry leaves nothing behind in the store.
+#
+# Runs on temporary directories, no Kore or database required.
+#
+#   $ python3 src/api/tests/history.py
+#
+
+import os
+import sys
+import hashlib
+import tempfile
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, f"{API}/bench")
+
+import korestub
+
+from api import Api, AMBRY_HISTORY
+
+UPLOADS = AMBRY_HISTORY * 2 + 1
+NAME = "ambry-0123456789abcdef"
+
+def upload(app, data):
+    src = app.ambry_spool(NAME)
+
+    with open(src, "wb") as f:
+        f.write(data)
+
+    return app.ambry_publish(src, NAME, hashlib.sha256(data).hexdigest())
+
+def store(app):
+    refs = f"{app.ambry_store_path}/refs/{NAME}"
+    objects = f"{app.ambry_store_path}/objects"
+
+    versions = os.listdir(refs) if os.path.isdir(refs) else []
+    return len(versions), len(os.listdir(objects))
+
+def check(failed, name, ok):
+    print(f"{'ok    ' if ok else 'FAILED'} {name}")
+    return failed + (0 if ok else 1)
+
+def main():
+    failed = 0
+
+    with tempfile.TemporaryDirectory() as path:
+        app = Api()
+        app.etags = {}
+        app.ambry_path = f"{path}/ambries"
+        app.ambry_store_path = f"{path}/store"
+        os.makedirs(app.ambry_path)
+
+        for idx in range(1, UPLOADS + 1):
+            data = f"version {idx}".encode()
+            changed = upload(app, data)
+            versions, objects = store(app)
+            expected = min(idx, AMBRY_HISTORY)
+
+            with open(f"{app.ambry_path}/{NAME}", "rb") as f:
+                current = f.read() == data
+
+            failed = check(failed,
+                f"upload {idx}: {versions} versions, {objects} objects",
+                changed and current and versions == expected and
+                objects == expected)
+
+        changed = upload(app, data)
+        versions, objects = store(app)
+        failed = check(failed,
+            f"identical upload: {versions} versions, {objects} objects",
+            not changed and versions == AMBRY_HISTORY and
+            objects == AMBRY_HISTORY)
+
+        app.ambry_remove(NAME)
+        versions, objects = store(app)
+        failed = check(failed,
+            f"removed: {versions} versions, {objects} objects",
+            versions == 0 and objects == 0 and
+            not os.path.exists(f"{app.ambry_path}/{NAME}"))
+
+    if failed != 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
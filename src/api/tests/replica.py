@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+#
+# Starts a primary and a streaming standby on temporary directories and
+# checks where Database sends its queries:
+#
+#   - REPLICA_QUERIES go to the standby while it is current
+#   - writes, other reads and primary=True reads go to the primary
+#   - everything goes to the primary while the standby lags more than
+#     the allowed lag, while it is disconnected from the primary and
+#     once it is gone, a query that fails on it is retried on the
+#     primary
+#
+# The queries go through korestub.pgsql() and the lag is checked by
+# the monitor task of Database itself.
+#
+# Needs the PostgreSQL server binaries, from PGBIN or the PATH, and
+# psycopg2. The servers refuse to run as root, so neither does this.
+#
+#   $ PGBIN=/usr/lib/postgresql/16/bin python3 src/api/tests/replica.py
+#
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import subprocess
+import psycopg2
+
+API = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, f"{API}/bench")
+
+import korestub
+import explain
+
+from queries import *
+from database import Database, REPLICA_QUERIES
+
+INTERVAL = 1
+MAXLAG = 3
+
+FLOCK = "0123456789abcdef"
+
+def binary(name):
+    return os.path.join(os.getenv("PGBIN", default=""), name)
+
+def pg(name, *args):
+    subprocess.run([binary(name), *args], check=True,
+        stdout=subprocess.DEVNULL)
+
+def start(data, sock):
+    pg("pg_ctl", "-D", data, "-l", f"{data}.log", "-w",
+        "-o", f"-k {sock} -c listen_addresses=''", "start")
+
+def connect(sock, dbname="accounts"):
+    conn = psycopg2.connect(f"host={sock} dbname={dbname}")
+    conn.autocommit = True
+    return conn
+
+def primary_create(path, sock):
+    pg("initdb", "-D", path, "-A", "trust", "-N")
+    start(path, sock)
+
+    conn = connect(sock, "postgres")
+    conn.cursor().execute("CREATE DATABASE accounts")
+    conn.close()
+
+    conn = psycopg2.connect(f"host={sock} dbname=accounts")
+    explain.install(conn)
+
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO accounts (account_key, account_time_left)
+        VALUES ('key-1', EXTRACT(epoch FROM now())::int + 86400)
+        RETURNING account_id
+    """)
+    account = cur.fetchone()[0]
+
+    cur.execute("""
+        INSERT INTO networks (network_token, network_owner)
+        VALUES (%s, %s)
+    """, [FLOCK, account])
+
+    conn.commit()
+    conn.close()
+
+    return f"{account}"
+
+def standby_create(path, sock, primary):
+    pg("pg_basebackup", "-h", primary, "-D", path, "-R",
+        "-X", "stream", "-c", "fast")
+    start(path, sock)
+
+def replayed(cur, flock):
+    cur.execute("SELECT 1 FROM networks WHERE network_token = %s", [flock])
+    return cur.fetchone() is not None
+
+async def until(cond, seconds):
+    end = time.monotonic() + seconds
+
+    while not cond():
+        if time.monotonic() > end:
+            return False
+        await asyncio.sleep(0.1)
+
+    return True
+
+def check(failed, name, ok):
+    print(f"{'ok    ' if ok else 'FAILED'} {name}")
+    return failed + (0 if ok else 1)
+
+async def checks(primary, standby, standby_path, account):
+    calls = []
+    query = korestub.dbquery
+
+    async def recorded(db, sql, params=None):
+        calls.append((db, sql))
+        return await query(db, sql, params=params)
+
+    korestub.dbquery = recorded
+
+    #
+    # Which databases a query was sent to, the replica followed by the
+    # primary when it failed on the replica and was retried.
+    #
+    async def routed(sql, params=None, primary=False):
+        start = len(calls)
+        await database.query(sql, params=params, primary=primary)
+        return [db for db, stmt in calls[start:] if stmt == sql]
+
+    reads = [
+        ("cathedrals", SQL_GET_CATHEDRALS, None),
+        ("cathedrals-version", SQL_CATHEDRALS_VERSION, None),
+        ("network-list", SQL_NETWORK_LIST, [account]),
+        ("device-list", SQL_DEVICE_LIST, [FLOCK, account]),
+        ("xflock-list", SQL_XFLOCK_LIST, [account]),
+    ]
+
+    failed = 0
+    database = Database(primary, standby, INTERVAL, MAXLAG)
+    conn = connect(standby)
+    cur = conn.cursor()
+
+    failed = check(failed, "standby in use",
+        await until(lambda: database.healthy, 10))
+
+    for name, sql, params in reads:
+        failed = check(failed, f"{name} on standby",
+            sql in REPLICA_QUERIES and
+            await routed(sql, params) == ["replica"])
+
+    failed = check(failed, "primary=True read on primary",
+        await routed(SQL_NETWORK_LIST, [account], True) == ["db"])
+    failed = check(failed, "other read on primary",
+        await routed(SQL_ACCOUNT_FROM_KEY, ["key-1"]) == ["db"])
+
+    failed = check(failed, "write on primary",
+        await routed(SQL_NETWORK_CREATE, ["fedcba9876543210", account]) ==
+        ["db"])
+
+    # Replayed, so the lag is measured from the time of this commit.
+    await until(lambda: replayed(cur, "fedcba9876543210"), 10)
+
+    cur.execute("SELECT pg_wal_replay_pause()")
+    await database.query(SQL_NETWORK_CREATE, ["fedcba9876543211", account])
+
+    await asyncio.sleep(INTERVAL * 1.5)
+    failed = check(failed, "standby in use while within the allowed lag",
+        database.healthy)
+    failed = check(failed, "standby bypassed when lagging",
+        await until(lambda: not database.healthy, MAXLAG + INTERVAL * 3))
+    failed = check(failed, "replica query on primary while lagging",
+        await routed(SQL_NETWORK_LIST, [account]) == ["db"])
+
+    cur.execute("SELECT pg_wal_replay_resume()")
+    failed = check(failed, "standby in use after catching up",
+        await until(lambda: database.healthy, INTERVAL * 5))
+
+    cur.execute("SHOW primary_conninfo")
+    conninfo = cur.fetchone()[0]
+    cur.execute("ALTER SYSTEM SET primary_conninfo = ''")
+    cur.execute("SELECT pg_reload_conf()")
+
+    failed = check(failed, "standby bypassed when disconnected",
+        await until(lambda: not database.healthy, INTERVAL * 5))
+    failed = check(failed, "replica query on primary while disconnected",
+        await routed(SQL_NETWORK_LIST, [account]) == ["db"])
+
+    cur.execute("ALTER SYSTEM SET primary_conninfo = %s", [conninfo])
+    cur.execute("SELECT pg_reload_conf()")
+    failed = check(failed, "standby in use after reconnecting",
+        await until(lambda: database.healthy, INTERVAL * 10))
+
+    conn.close()
+    pg("pg_ctl", "-D", standby_path, "-m", "fast", "stop")
+
+    # The monitor may not have noticed yet when the next query comes in.
+    database.healthy = True
+    failed = check(failed, "replica query retried on primary when stopped",
+        await routed(SQL_NETWORK_LIST, [account]) == ["replica", "db"] and
+        not database.healthy)
+    failed = check(failed, "standby bypassed when stopped",
+        await until(lambda: not database.healthy, INTERVAL * 5) and
+        await routed(SQL_NETWORK_LIST, [account]) == ["db"])
+
+    return failed
+
+def main():
+    if os.geteuid() == 0:
+        sys.exit("replica.py: run as an unprivileged user")
+
+    korestub.pgsql()
+    path = tempfile.mkdtemp(prefix="replica-")
+
+    primary = f"{path}/primary"
+    standby = f"{path}/standby"
+
+    try:
+        os.mkdir(f"{primary}.sock")
+        os.mkdir(f"{standby}.sock")
+
+        account = primary_create(primary, f"{primary}.sock")
+        standby_create(standby, f"{standby}.sock", f"{primary}.sock")
+
+        failed = asyncio.run(checks(f"{primary}.sock", f"{standby}.sock",
+            standby, account))
+    finally:
+        for data in (standby, primary):
+            if os.path.exists(f"{data}/postmaster.pid"):
+                subprocess.run([binary("pg_ctl"), "-D", data,
+                    "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(path)
+
+    if failed != 0:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+#
+# Copyright (c) 2025-2026 Joris Vink <joris@sanctorum.se>
+#
+# Permission to use, copy, modify, and distribute this software for any
+# purpose with or without fee is hereby granted, provided that the above
+# copyright notice and this permission notice appear in all copies.
+#
+# THE SOFTWARE IS PROVIDED "AS IS" AND THE AUTHOR DISCLAIMS ALL WARRANTIES
+# WITH REGARD TO THIS SOFTWARE INCLUDING ALL IMPLIED WARRANTIES OF
+# MERCHANTABILITY AND FITNESS. IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR
+# ANY SPECIAL, DIRECT, INDIRECT, OR CONSEQUENTIAL DAMAGES OR ANY DAMAGES
+# WHATSOEVER RESULTING FROM LOSS OF USE, DATA OR PROFITS, WHETHER IN AN
+# ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
+# OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
+
+import kore
+import time
+
+from queries import SQL_TOKEN_REFRESH
+
+TOKEN_LIFETIME = 2592000
+
+#
+# Sliding token expiry without a write on every authenticated request.
+#
+# Tokens that were used are remembered in memory and their expiry is
+# pushed forward in one batched UPDATE every interval seconds, but only
+# once the stored expiry lags behind by more than slack seconds.
+#
+# If the worker dies before a flush we lose at most one interval worth
+# of refreshes, which only makes the affected tokens expire a bit early.
+#
+class TokenRefresher:
+    def __init__(self, app, interval, slack):
+        self.app = app
+        self.slack = slack
+        self.interval = interval
+        self.pending = set()
+        kore.task_create(self.flush())
+
+    def touch(self, token, expires):
+        if (time.time() + TOKEN_LIFETIME) - expires < self.slack:
+            return
+
+        self.pending.add(token)
+
+    async def flush(self):
+        while True:
+            await kore.suspend(self.interval * 1000)
+
+            if len(self.pending) == 0:
+                continue
+
+            tokens = self.pending
+            self.pending = set()
+
+            try:
+                await kore.dbquery("db",
+                    SQL_TOKEN_REFRESH,
+                    params=[",".join(tokens)]
+                )
+            except Exception as e:
+                kore.log(kore.LOG_NOTICE, f"token refresh failed: {e}")
+                self.pending |= tokens